@@ -3,6 +3,31 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Deployment profile
+------------------
+The storefront views (home, profile, checkout) are async and use the async
+ORM, so a slow client holds a coroutine, not a worker thread; everything
+else is sync and Django runs it in a thread pool. Serve it with one event
+loop per CPU core, e.g.::
+
+    uvicorn config.asgi:application --workers 4 --lifespan off
+    # or: gunicorn config.asgi:application -k uvicorn.workers.UvicornWorker -w 4
+
+- Keep ``CONN_MAX_AGE`` at 0 (the default): async views reach the database
+  through per-request threads, and persistent connections there are never
+  reused, only leaked.
+- Checkout's direct mode still runs place_order() in one transaction on the
+  sync thread; under heavy load set CHECKOUT_QUEUED=True so checkout only
+  records the cart (fully async) and run ``manage.py process_checkouts
+  --loop`` alongside.
+- With more than one worker, point CACHES at Redis or Memcached: the
+  admission counters (store.admission) live in the cache, and the
+  default LocMemCache gives every worker its own.
+- The CSV / NDJSON exports stream here too: store.exports hands ASGI an
+  async iterator, since a sync one would be read whole into memory first.
+- ``manage.py benchmark_asgi`` compares this entry point with config.wsgi
+  under many simultaneous slow clients.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -93,6 +93,10 @@ DATABASES = {
     }
 }
 
+# Intake mode for drop openings: checkout queues carts as PendingCheckout
+# rows and the process_checkouts command places them in batches.
+CHECKOUT_QUEUED = os.getenv('CHECKOUT_QUEUED') == 'True'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -19,6 +19,8 @@ from django.urls import path, include
 from users.views import signup, verify_email
 from store.views import home, checkout, profile, batch_fulfillment_report, customer_order_history
 from store.views import add_menu_item, edit_menu_item, delete_menu_item, archive_menu_week, create_menu_week
+from store.views import menu_week_report, export_fulfillment_report, export_order_book, shopping_list
+from store.views import prep_sheet, export_prep_sheet, refresh_menu_week_prices
 from inventory.views import (
     chef_dashboard,
     add_ingredient,
@@ -31,6 +33,7 @@ from inventory.views import (
     delete_recipe,
     manage_meal,
     delete_meal,
+    price_simulator,
 )
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -39,6 +42,9 @@ urlpatterns = [
     path('profile/', profile, name='profile'),
     path('chef/customers/<int:customer_id>/orders/', customer_order_history, name='customer_order_history'),
     path('report/current/', batch_fulfillment_report, name='fulfillment_report'),
+    path('report/current/export.<str:fmt>', export_fulfillment_report, name='export_fulfillment_report'),
+    path('report/current/prep/', prep_sheet, name='prep_sheet'),
+    path('report/current/prep/export.<str:fmt>', export_prep_sheet, name='export_prep_sheet'),
     
     # Auth Routes
     path('signup/', signup, name='signup'),
@@ -58,9 +64,14 @@ urlpatterns = [
     path('chef/meal/add/', manage_meal, name='add_meal'),
     path('chef/meal/edit/<int:meal_id>/', manage_meal, name='edit_meal'),
     path('chef/meal/delete/<int:meal_id>/', delete_meal, name='delete_meal'),
+    path('chef/price-simulator/', price_simulator, name='price_simulator'),
     path('chef/menu/add/', add_menu_item, name='add_menu_item'),
     path('chef/menu/edit/<int:item_id>/', edit_menu_item, name='edit_menu_item'),
     path('chef/menu/delete/<int:item_id>/', delete_menu_item, name='delete_menu_item'),
     path('chef/menu-week/archive/<int:week_id>/', archive_menu_week, name='archive_menu_week'),
     path('chef/menu-week/create/', create_menu_week, name='create_menu_week'),
+    path('chef/menu-week/<int:week_id>/refresh-prices/', refresh_menu_week_prices, name='refresh_menu_week_prices'),
+    path('chef/menu-week/<int:week_id>/report/', menu_week_report, name='menu_week_report'),
+    path('chef/menu-week/<int:week_id>/orders.<str:fmt>', export_order_book, name='export_order_book'),
+    path('chef/shopping-list/', shopping_list, name='shopping_list'),
 ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Ingredient, Recipe, RecipeIngredient
+from .models import Ingredient, IngredientPriceHistory, Recipe, RecipeIngredient, UnitConversion
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
@@ -10,8 +10,23 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = [RecipeIngredientInline]
     list_display = ('name', 'get_cost_display')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_cost()
+
     def get_cost_display(self, obj):
-        return f"${obj.calculate_cost():.2f}"
+        return f"${obj.cost:.2f}"
     get_cost_display.short_description = "Cost"
+    get_cost_display.admin_order_field = 'cost'
+
+admin.site.register(Ingredient)
+
+@admin.register(IngredientPriceHistory)
+class IngredientPriceHistoryAdmin(admin.ModelAdmin):
+    list_display = ('ingredient', 'cost_per_unit', 'effective_at')
+    list_filter = ('ingredient',)
+    date_hierarchy = 'effective_at'
 
-admin.site.register(Ingredient)
\ No newline at end of file
+@admin.register(UnitConversion)
+class UnitConversionAdmin(admin.ModelAdmin):
+    list_display = ('from_unit', 'factor', 'to_unit', 'ingredient')
+    list_filter = ('ingredient',)
@@ -0,0 +1,142 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import Q
+from djmoney.money import Money
+
+from .cost_engine import CostMatrix
+from .models import (
+    Meal,
+    MealRecipe,
+    Recipe,
+    RecipeIngredient,
+    name_key_expression,
+    normalize_ingredient_name,
+)
+from .requirements import rebuild_meal_requirements
+
+logger = logging.getLogger(__name__)
+
+# Recipe/meal ids collected while inside deferred_propagation().
+_pending = ContextVar('pending_cost_propagation', default=None)
+
+
+def recipes_using_ingredient(ingredient, names=()):
+    """
+    Ids of recipes whose cost depends on `ingredient`, either through the
+    foreign key or through a free-text row that resolves to it by name.
+
+    RecipeIngredient's ingredient_id index and its name-key expression index
+    make this the ingredient -> recipe half of the reverse dependency index;
+    MealRecipe's recipe_id index is the recipe -> meal half.
+    """
+    lookup = Q(ingredient=ingredient) if ingredient is not None else Q(pk__in=[])
+    keys = {normalize_ingredient_name(name) for name in names} - {''}
+    if keys:
+        lookup |= Q(ingredient__isnull=True, name_key__in=keys)
+    return set(
+        RecipeIngredient.objects.alias(name_key=name_key_expression('ingredient_name'))
+        .filter(lookup)
+        .values_list('recipe_id', flat=True)
+    )
+
+
+@contextmanager
+def deferred_propagation():
+    """
+    Collects every cost change made inside the block and propagates them
+    once on a clean exit, so saving a recipe with ten ingredient rows
+    re-costs it once rather than ten times. Nested blocks join the
+    outermost one.
+    """
+    if _pending.get() is not None:
+        yield
+        return
+    pending = {'recipes': set(), 'meals': set(), 'requirements': False}
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    propagate_cost_changes(
+        recipe_ids=pending['recipes'],
+        meal_ids=pending['meals'],
+        requirements=pending['requirements'],
+    )
+
+
+def propagate_cost_changes(recipe_ids=(), meal_ids=(), requirements=True):
+    """
+    Re-costs the given recipes, then only the meals that contain them (plus
+    `meal_ids`). Only rows whose value actually changed are written. Menu
+    items and orders keep the costs their week captured (see
+    store.models.MenuWeek.snapshot_prices) until the chef refreshes them.
+
+    Unless `requirements` is False (a price-only change), the
+    MealIngredientRequirement rows of those meals are rebuilt as well.
+
+    Returns a dict counting the rows written per table, which is also
+    logged so write amplification can be watched; returns None when the
+    change was deferred.
+    """
+    pending = _pending.get()
+    if pending is not None:
+        pending['recipes'].update(recipe_ids)
+        pending['meals'].update(meal_ids)
+        pending['requirements'] = pending['requirements'] or requirements
+        return None
+
+    touched = {'recipes': 0, 'meals': 0, 'requirements': 0}
+    recipe_ids = set(recipe_ids)
+    meal_ids = set(meal_ids)
+
+    if recipe_ids:
+        recipe_costs, _ = CostMatrix.load(recipe_ids=recipe_ids, meal_ids=()).costs()
+        touched['recipes'] = _write_changed(Recipe, recipe_costs)
+        meal_ids.update(MealRecipe.objects.filter(recipe_id__in=recipe_ids).values_list('meal_id', flat=True))
+
+    if meal_ids:
+        _, meal_costs = CostMatrix.load(meal_ids=meal_ids).costs()
+        touched['meals'] = _write_changed(Meal, meal_costs)
+        if requirements:
+            touched['requirements'] = rebuild_meal_requirements(meal_ids)
+
+    if any(touched.values()):
+        logger.info(
+            "Cost propagation from %d recipe(s), %d meal(s) wrote %s",
+            len(recipe_ids), len(meal_ids), touched,
+        )
+    return touched
+
+
+def _write_changed(model, costs):
+    """bulk_update cached_cost for the rows in `costs` whose stored value differs."""
+    changed = [
+        model(pk=pk, cached_cost=Money(costs[pk], 'USD'))
+        for pk, cached in model.objects.filter(pk__in=list(costs)).values_list('pk', 'cached_cost')
+        if cached != round(costs[pk], 2)
+    ]
+    model.objects.bulk_update(changed, ['cached_cost'])
+    return len(changed)
+
+
+def stale_costs():
+    """
+    Yields (object, cached, actual) for every Recipe and Meal whose
+    cached_cost no longer matches its cost at current prices.
+    """
+    recipe_costs, meal_costs = CostMatrix.load().costs()
+    for model, costs in ((Recipe, recipe_costs), (Meal, meal_costs)):
+        for obj in model.objects.only('name', 'cached_cost', 'cached_cost_currency'):
+            actual = Money(costs.get(obj.pk, 0), 'USD')
+            if obj.cached_cost.amount != round(actual.amount, 2):
+                yield obj, obj.cached_cost, actual
+
+
+def rebuild_all_costs():
+    """Rewrites every cached_cost from one whole-catalog CostMatrix pass."""
+    recipe_costs, meal_costs = CostMatrix.load().costs()
+    for model, costs in ((Recipe, recipe_costs), (Meal, meal_costs)):
+        objs = [model(pk=pk, cached_cost=Money(cost, 'USD')) for pk, cost in costs.items()]
+        model.objects.bulk_update(objs, ['cached_cost'], batch_size=500)
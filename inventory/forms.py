@@ -1,7 +1,8 @@
 import re
+from decimal import Decimal
 from django import forms
 from django.forms import inlineformset_factory
-from .models import Ingredient, IngredientUnit, Recipe, RecipeIngredient
+from .models import Ingredient, IngredientUnit, Recipe, RecipeIngredient, normalize_ingredient_name
 from .models import Meal, MealRecipe
 from djmoney.forms.widgets import MoneyWidget 
 
@@ -133,3 +134,49 @@ MealRecipeFormSet = inlineformset_factory(
     can_delete=True
 )
 
+
+
+class PriceChangeForm(forms.Form):
+    """
+    Parses what-if price changes such as "butter +12%, flour $0.45/lb".
+    Each entry is an ingredient name followed by either a signed percentage
+    or a new price per unit (a trailing "/unit" is accepted and ignored).
+    """
+    CHANGE_PATTERN = re.compile(
+        r'^(?P<name>.+?)\s+(?:(?P<percent>[+-]\d+(?:\.\d+)?)%|\$?(?P<price>\d+(?:\.\d+)?)(?:\s*/\s*\S+)?)$'
+    )
+
+    changes = forms.CharField(
+        widget=forms.Textarea(attrs={
+            'class': 'form-input',
+            'rows': 3,
+            'placeholder': 'butter +12%, flour $0.45/lb',
+        }),
+    )
+
+    def clean_changes(self):
+        """Returns {ingredient_id: new cost_per_unit amount}."""
+        entries = [entry.strip() for entry in re.split(r'[,\n]', self.cleaned_data['changes']) if entry.strip()]
+        parsed = []
+        for entry in entries:
+            match = self.CHANGE_PATTERN.match(entry)
+            if not match:
+                raise forms.ValidationError(f'Could not read "{entry}". Use "name +12%" or "name $0.45".')
+            parsed.append(match)
+
+        keys = {normalize_ingredient_name(match['name']) for match in parsed}
+        by_key = {}
+        for ingredient in Ingredient.objects.filter(name_key__in=keys).order_by('pk'):
+            by_key.setdefault(ingredient.name_key, ingredient)
+
+        new_prices = {}
+        for match in parsed:
+            ingredient = by_key.get(normalize_ingredient_name(match['name']))
+            if not ingredient:
+                raise forms.ValidationError(f'No ingredient named "{match["name"]}".')
+            if match['percent'] is not None:
+                factor = 1 + Decimal(match['percent']) / 100
+                new_prices[ingredient.pk] = ingredient.cost_per_unit.amount * factor
+            else:
+                new_prices[ingredient.pk] = Decimal(match['price'])
+        return new_prices
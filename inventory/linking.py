@@ -0,0 +1,61 @@
+from django.db import transaction
+
+from .models import Ingredient, RecipeIngredient, name_key_expression, normalize_ingredient_name
+
+
+def link_recipe_ingredients(names=None, chunk_size=500, dry_run=False):
+    """
+    Converts free-text RecipeIngredient rows (ingredient_name only) into
+    foreign keys to the Ingredient they already resolve to by name.
+
+    Pass `names` to limit the work to rows matching those ingredient names.
+    Rows are read and rewritten with bulk_update in chunks of `chunk_size`,
+    one transaction per chunk. Resolution is unchanged by linking, so no
+    cached costs or meal requirements need refreshing. A row keeps its own
+    unit only when it differs from the ingredient's stock unit.
+
+    Returns a (linked, unmatched) pair of lists of RecipeIngredient rows;
+    with `dry_run` the linked rows are matched but not saved.
+    """
+    pending = (
+        RecipeIngredient.objects.filter(ingredient__isnull=True)
+        .exclude(ingredient_name='')
+        .alias(name_key=name_key_expression('ingredient_name'))
+        .order_by('pk')
+    )
+    ingredients = Ingredient.objects.order_by('pk')
+    if names is not None:
+        keys = {normalize_ingredient_name(name) for name in names} - {''}
+        pending = pending.filter(name_key__in=keys)
+        ingredients = ingredients.filter(name_key__in=keys)
+
+    by_key = {}
+    for ingredient in ingredients:
+        by_key.setdefault(ingredient.name_key, ingredient)
+
+    # The pks are read up front and each chunk is loaded whole before it is
+    # written, so no open cursor is still reading rows being rewritten.
+    pks = list(pending.values_list('pk', flat=True))
+    linked, unmatched = [], []
+    for start in range(0, len(pks), chunk_size):
+        chunk = []
+        for ri in RecipeIngredient.objects.filter(pk__in=pks[start:start + chunk_size]).order_by('pk'):
+            ingredient = by_key.get(normalize_ingredient_name(ri.ingredient_name))
+            if not ingredient:
+                unmatched.append(ri)
+                continue
+            ri.ingredient = ingredient
+            ri.ingredient_name = ''
+            if ri.ingredient_unit_id == ingredient.unit_id:
+                ri.ingredient_unit = None
+            chunk.append(ri)
+        _save_chunk(chunk, dry_run)
+        linked.extend(chunk)
+    return linked, unmatched
+
+
+def _save_chunk(rows, dry_run):
+    if dry_run or not rows:
+        return
+    with transaction.atomic():
+        RecipeIngredient.objects.bulk_update(rows, ['ingredient', 'ingredient_name', 'ingredient_unit'])
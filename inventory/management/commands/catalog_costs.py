@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from inventory.cost_engine import catalog_costs
+from inventory.models import Meal, Recipe
+
+
+class Command(BaseCommand):
+    help = "Print the cost of every meal (and optionally every recipe) at current ingredient prices."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            action='store_true',
+            help="Also list every recipe cost.",
+        )
+
+    def handle(self, *args, **options):
+        recipe_costs, meal_costs = catalog_costs()
+
+        if options['recipes']:
+            self.stdout.write("Recipes")
+            for pk, name in Recipe.objects.order_by('name').values_list('pk', 'name'):
+                self.stdout.write(f"  {name:<40} {recipe_costs[pk]:>10.2f}")
+            self.stdout.write("")
+
+        self.stdout.write(f"{'Meal':<40} {'Cost':>10} {'Price':>10} {'Profit':>10}")
+        for meal in Meal.objects.order_by('name').only('name', 'customer_price', 'customer_price_currency'):
+            cost = meal_costs[meal.pk]
+            if meal.customer_price:
+                price = meal.customer_price.amount
+                self.stdout.write(f"{meal.name:<40} {cost:>10.2f} {price:>10.2f} {price - cost:>10.2f}")
+            else:
+                self.stdout.write(f"{meal.name:<40} {cost:>10.2f} {'--':>10} {'--':>10}")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.costs import rebuild_all_costs, stale_costs
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cached_cost column on every Recipe and Meal."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report stale cached costs; exit with an error if any are found.",
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            stale = list(stale_costs())
+            for obj, cached, actual in stale:
+                self.stdout.write(
+                    f"{obj._meta.verbose_name} #{obj.pk} {obj.name}: cached {cached}, actual {actual}"
+                )
+            if stale:
+                raise CommandError(f"{len(stale)} stale cached cost(s). Run rebuild_costs to fix.")
+            self.stdout.write(self.style.SUCCESS("All cached costs are current."))
+            return
+
+        rebuild_all_costs()
+        self.stdout.write(self.style.SUCCESS("Rebuilt cached costs."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from inventory.requirements import rebuild_meal_requirements
+
+
+class Command(BaseCommand):
+    help = "Rebuild the flattened MealIngredientRequirement table for every meal (or the given meal ids)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('meal_ids', nargs='*', type=int, help="Only rebuild these meals.")
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Rows per INSERT (default 500).",
+        )
+
+    def handle(self, *args, **options):
+        meal_ids = options['meal_ids'] or None
+        written = rebuild_meal_requirements(meal_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} meal requirement row(s)."))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from inventory.linking import link_recipe_ingredients
+
+
+class Command(BaseCommand):
+    help = "Link free-text recipe ingredients to the Ingredient rows they match by name."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Report what would be linked without writing anything.",
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help="Rows rewritten per bulk_update/transaction (default 500).",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        linked, unmatched = link_recipe_ingredients(chunk_size=options['chunk_size'], dry_run=dry_run)
+
+        if options['verbosity'] > 1:
+            for ri in linked:
+                self.stdout.write(f"link  #{ri.pk} recipe {ri.recipe_id}: {ri.ingredient.name}")
+        for ri in unmatched:
+            self.stdout.write(f"no match  #{ri.pk} recipe {ri.recipe_id}: {ri.ingredient_name!r}")
+
+        verb = "Would link" if dry_run else "Linked"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(linked)} recipe ingredient(s); {len(unmatched)} left unmatched."
+        ))
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+def populate_name_keys(apps, schema_editor):
+    Ingredient = apps.get_model('inventory', 'Ingredient')
+
+    ingredients = list(Ingredient.objects.all())
+    for ingredient in ingredients:
+        ingredient.name_key = ingredient.name.strip().lower()
+    Ingredient.objects.bulk_update(ingredients, ['name_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_cached_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='name_key',
+            field=models.CharField(db_index=True, default='', editable=False, help_text='Normalized name that free-text recipe rows resolve against', max_length=100),
+        ),
+        migrations.RunPython(populate_name_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_requirements(apps, schema_editor):
+    Ingredient = apps.get_model('inventory', 'Ingredient')
+    MealRecipe = apps.get_model('inventory', 'MealRecipe')
+    RecipeIngredient = apps.get_model('inventory', 'RecipeIngredient')
+    MealIngredientRequirement = apps.get_model('inventory', 'MealIngredientRequirement')
+
+    by_key = {}
+    for ingredient in Ingredient.objects.order_by('pk'):
+        by_key.setdefault(ingredient.name_key, ingredient)
+
+    recipe_rows = {}
+    for ri in RecipeIngredient.objects.select_related('ingredient'):
+        resolved = ri.ingredient or by_key.get(ri.ingredient_name.strip().lower())
+        if resolved:
+            key = (resolved.pk, '', resolved.unit_id)
+        elif ri.ingredient_name.strip():
+            key = (None, ri.ingredient_name.strip(), ri.ingredient_unit_id)
+        else:
+            continue
+        recipe_rows.setdefault(ri.recipe_id, []).append((key, ri.quantity))
+
+    totals = {}
+    for mr in MealRecipe.objects.all():
+        for key, quantity in recipe_rows.get(mr.recipe_id, ()):
+            totals[(mr.meal_id, *key)] = totals.get((mr.meal_id, *key), 0) + quantity * mr.quantity
+    MealIngredientRequirement.objects.bulk_create([
+        MealIngredientRequirement(
+            meal_id=meal_id, ingredient_id=ingredient_id, ingredient_name=name, unit_id=unit_id, quantity=quantity,
+        )
+        for (meal_id, ingredient_id, name, unit_id), quantity in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_ingredientpricehistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MealIngredientRequirement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ingredient_name', models.CharField(blank=True, max_length=100)),
+                ('quantity', models.DecimalField(decimal_places=4, help_text='Amount needed per serving of the meal', max_digits=14)),
+                ('ingredient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='meal_requirements', to='inventory.ingredient')),
+                ('meal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_requirements', to='inventory.meal')),
+                ('unit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='inventory.ingredientunit')),
+            ],
+        ),
+        migrations.RunPython(populate_requirements, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:08
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def seed_stock_unit_factors(apps, schema_editor):
+    # No conversions exist yet, so each ingredient only converts from its own unit.
+    Ingredient = apps.get_model('inventory', 'Ingredient')
+    IngredientUnitFactor = apps.get_model('inventory', 'IngredientUnitFactor')
+    IngredientUnitFactor.objects.bulk_create([
+        IngredientUnitFactor(ingredient_id=pk, unit_id=unit_id, factor=1)
+        for pk, unit_id in Ingredient.objects.values_list('pk', 'unit_id')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_mealingredientrequirement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnitConversion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factor', models.DecimalField(decimal_places=9, help_text='How many to_unit make one from_unit', max_digits=18, validators=[django.core.validators.MinValueValidator(Decimal('1E-9'))])),
+                ('from_unit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversions_from', to='inventory.ingredientunit')),
+                ('ingredient', models.ForeignKey(blank=True, help_text='Only for this ingredient; leave blank for a conversion that holds for everything', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='unit_conversions', to='inventory.ingredient')),
+                ('to_unit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversions_to', to='inventory.ingredientunit')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IngredientUnitFactor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factor', models.DecimalField(decimal_places=9, max_digits=18)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unit_factors', to='inventory.ingredient')),
+                ('unit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.ingredientunit')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ingredient', 'unit'), name='unique_ingredient_unit_factor')],
+            },
+        ),
+        migrations.RunPython(seed_stock_unit_factors, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,178 @@
+from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import (
+    Case,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Lower, Trim
+from django.utils import timezone
 from django.utils.functional import cached_property
 from decimal import Decimal
 from djmoney.models.fields import MoneyField
 
 
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+FACTOR_FIELD = DecimalField(max_digits=18, decimal_places=9)
+
+
+def normalize_ingredient_name(name):
+    """The lookup key free-text recipe rows are matched on (see Ingredient.name_key)."""
+    return (name or '').strip().lower()
+
+
+def name_key_expression(field):
+    """SQL counterpart of normalize_ingredient_name() for a text column."""
+    return Lower(Trim(field))
+
+
+def resolve_ingredients(recipe_ingredients):
+    """
+    Fills resolved_ingredient on every RecipeIngredient in the iterable with
+    at most one IN query for all free-text rows, instead of one iexact
+    lookup per row. Rows that are linked or already resolved cost nothing;
+    callers should select_related/prefetch 'ingredient' beforehand.
+
+    Returns the rows as a list.
+    """
+    rows = list(recipe_ingredients)
+    pending = [
+        ri for ri in rows
+        if 'resolved_ingredient' not in ri.__dict__ and not ri.ingredient_id
+    ]
+    keys = {normalize_ingredient_name(ri.ingredient_name) for ri in pending} - {''}
+    by_key = {}
+    if keys:
+        for ingredient in Ingredient.objects.filter(name_key__in=keys).select_related('unit').order_by('pk'):
+            by_key.setdefault(ingredient.name_key, ingredient)
+    for ri in pending:
+        ri.__dict__['resolved_ingredient'] = by_key.get(normalize_ingredient_name(ri.ingredient_name))
+
+    converting = [
+        ri for ri in rows
+        if 'unit_factor' not in ri.__dict__ and ri.resolved_ingredient and ri.ingredient_unit_id
+    ]
+    if converting:
+        factors = dict(
+            ((ingredient_id, unit_id), factor)
+            for ingredient_id, unit_id, factor in IngredientUnitFactor.objects.filter(
+                ingredient__in={ri.resolved_ingredient.pk for ri in converting},
+                unit__in={ri.ingredient_unit_id for ri in converting},
+            ).values_list('ingredient_id', 'unit_id', 'factor')
+        )
+        for ri in converting:
+            ri.__dict__['unit_factor'] = factors.get((ri.resolved_ingredient.pk, ri.ingredient_unit_id))
+    return rows
+
+
+def unit_factor_expression(unit, ingredient):
+    """
+    SQL for the factor that converts a quantity in `unit` into the stock
+    unit of `ingredient` (both names of columns or annotations on the outer
+    query), read from IngredientUnitFactor: 1 when there is no unit, NULL
+    when no conversion is known.
+    """
+    factor = IngredientUnitFactor.objects.filter(
+        ingredient=OuterRef(ingredient),
+        unit=OuterRef(unit),
+    ).values('factor')
+    return Case(
+        When(**{f'{unit}__isnull': True}, then=Value(Decimal('1'))),
+        default=Subquery(factor),
+        output_field=FACTOR_FIELD,
+    )
+
+
+def recipe_cost_subquery(recipe_ref):
+    """
+    Correlated subquery summing quantity * cost_per_unit over the recipe's
+    ingredients; free-text rows are costed against the first Ingredient
+    whose name matches, exactly like RecipeIngredient.resolved_ingredient,
+    and quantities are converted into the ingredient's stock unit first.
+    """
+    named = Ingredient.objects.filter(
+        name_key=name_key_expression(OuterRef('ingredient_name')),
+    ).order_by('pk').values('pk')[:1]
+    # Price per unit of the row's own unit where a conversion is known;
+    # otherwise (no unit of its own, or none known) the plain stock price.
+    converted_price = IngredientUnitFactor.objects.filter(
+        ingredient=OuterRef('resolved_id'),
+        unit=OuterRef('ingredient_unit_id'),
+    ).values(price=ExpressionWrapper(F('factor') * F('ingredient__cost_per_unit'), output_field=AMOUNT_FIELD))
+    price = Ingredient.objects.filter(pk=OuterRef('resolved_id')).values('cost_per_unit')
+    lines = (
+        RecipeIngredient.objects.filter(recipe=recipe_ref)
+        .alias(resolved_id=Coalesce('ingredient_id', Subquery(named), output_field=IntegerField()))
+        .annotate(line_cost=ExpressionWrapper(
+            F('quantity') * Coalesce(Subquery(converted_price), Subquery(price)),
+            output_field=AMOUNT_FIELD,
+        ))
+        .values('recipe')
+        .annotate(total=Sum('line_cost'))
+        .values('total')
+    )
+    return Coalesce(Subquery(lines, output_field=AMOUNT_FIELD), Value(Decimal('0')), output_field=AMOUNT_FIELD)
+
+
+class RecipeIngredientQuerySet(models.QuerySet):
+    def with_resolution(self):
+        """
+        Annotates, in SQL, what resolved_ingredient and unit_factor compute
+        per row: `resolved_id` (the linked Ingredient, else the first one
+        whose name matches), `stock_unit_id` (that ingredient's unit) and
+        `unit_factor` (converts quantity into stock_unit_id; NULL when no
+        conversion is known).
+        """
+        named = Ingredient.objects.filter(
+            name_key=name_key_expression(OuterRef('ingredient_name')),
+        ).order_by('pk').values('pk')[:1]
+        return (
+            self.annotate(resolved_id=Coalesce('ingredient_id', Subquery(named), output_field=IntegerField()))
+            .annotate(stock_unit_id=Subquery(Ingredient.objects.filter(pk=OuterRef('resolved_id')).values('unit_id')))
+            .annotate(unit_factor=unit_factor_expression('ingredient_unit_id', 'resolved_id'))
+        )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_cost(self):
+        """Annotates `cost` (a Decimal amount in USD) on every recipe in one query."""
+        return self.annotate(cost=recipe_cost_subquery(OuterRef('pk')))
+
+
+class MealQuerySet(models.QuerySet):
+    def with_cost(self):
+        """Annotates `cost` (a Decimal amount in USD) on every meal in one query."""
+        lines = (
+            MealRecipe.objects.filter(meal=OuterRef('pk'))
+            .annotate(line_cost=ExpressionWrapper(
+                F('quantity') * recipe_cost_subquery(OuterRef('recipe')),
+                output_field=AMOUNT_FIELD,
+            ))
+            .values('meal')
+            .annotate(total=Sum('line_cost'))
+            .values('total')
+        )
+        return self.annotate(
+            cost=Coalesce(Subquery(lines, output_field=AMOUNT_FIELD), Value(Decimal('0')), output_field=AMOUNT_FIELD)
+        )
+
+    def with_cost_and_profit(self):
+        """Like with_cost(), plus `profit`: customer_price (or 0) minus cost."""
+        return self.with_cost().annotate(
+            profit=ExpressionWrapper(
+                Coalesce(F('customer_price'), Value(Decimal('0')), output_field=AMOUNT_FIELD) - F('cost'),
+                output_field=AMOUNT_FIELD,
+            )
+        )
+
+
 class IngredientUnit(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
@@ -16,6 +185,13 @@ class IngredientUnit(models.Model):
 
 class Ingredient(models.Model):
     name = models.CharField(max_length=100)
+    name_key = models.CharField(
+        max_length=100,
+        default='',
+        db_index=True,
+        editable=False,
+        help_text="Normalized name that free-text recipe rows resolve against"
+    )
     quantity = models.DecimalField(
         max_digits=10, 
         decimal_places=2, 
@@ -29,6 +205,13 @@ class Ingredient(models.Model):
     def unit_display(self):
         return self.unit.name
 
+    def save(self, *args, **kwargs):
+        self.name_key = normalize_ingredient_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'name_key'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({self.quantity} {self.unit_display})"
 
@@ -36,20 +219,106 @@ class Ingredient(models.Model):
     def total_cost(self):
         return self.quantity * self.cost_per_unit
 
+class IngredientPriceHistory(models.Model):
+    """
+    Append-only log of Ingredient.cost_per_unit. A row is written whenever
+    an ingredient is created or its cost changes (see inventory.signals).
+    """
+    ingredient = models.ForeignKey(Ingredient, related_name='price_history', on_delete=models.CASCADE)
+    cost_per_unit = MoneyField(max_digits=14, decimal_places=2, default_currency='USD')
+    effective_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-effective_at']
+        indexes = [
+            models.Index(fields=['ingredient', 'effective_at'], name='ingredient_price_asof'),
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient.name} @ {self.cost_per_unit} from {self.effective_at:%Y-%m-%d %H:%M}"
+
+class UnitConversion(models.Model):
+    """
+    A chef-entered conversion: 1 from_unit = factor to_unit. Set
+    `ingredient` for conversions that depend on density (cups of flour to
+    pounds); leave it empty for fixed ones (pounds to ounces). The reverse
+    direction and chains of conversions are derived, see
+    IngredientUnitFactor.
+    """
+    from_unit = models.ForeignKey(IngredientUnit, related_name='conversions_from', on_delete=models.CASCADE)
+    to_unit = models.ForeignKey(IngredientUnit, related_name='conversions_to', on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='unit_conversions',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        help_text="Only for this ingredient; leave blank for a conversion that holds for everything",
+    )
+    factor = models.DecimalField(
+        max_digits=18,
+        decimal_places=9,
+        validators=[MinValueValidator(Decimal('0.000000001'))],
+        help_text="How many to_unit make one from_unit",
+    )
+
+    def __str__(self):
+        scope = f" ({self.ingredient.name})" if self.ingredient else ""
+        return f"1 {self.from_unit} = {self.factor} {self.to_unit}{scope}"
+
+
+class IngredientUnitFactor(models.Model):
+    """
+    Precomputed from UnitConversion: for every ingredient, the factor that
+    takes a quantity in `unit` into the ingredient's stock unit, for every
+    unit reachable through any chain of conversions (generic ones plus the
+    ingredient's own, in either direction). The stock unit itself is
+    always present with factor 1. Rebuilt by inventory.units when
+    conversions or an ingredient's unit change, so costing and reporting
+    join one row instead of walking the conversion graph.
+    """
+    ingredient = models.ForeignKey(Ingredient, related_name='unit_factors', on_delete=models.CASCADE)
+    unit = models.ForeignKey(IngredientUnit, related_name='+', on_delete=models.CASCADE)
+    factor = models.DecimalField(max_digits=18, decimal_places=9)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ingredient', 'unit'], name='unique_ingredient_unit_factor'),
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient.name}: 1 {self.unit} = {self.factor} {self.ingredient.unit}"
+
+
 class Recipe(models.Model):
     name = models.CharField(max_length=200)
     instructions = models.TextField(blank=True)
+    cached_cost = MoneyField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        default_currency='USD',
+        editable=False,
+        help_text="Materialized result of calculate_cost(), kept current by inventory.signals"
+    )
+
+    objects = RecipeQuerySet.as_manager()
     
     def calculate_cost(self):
             from djmoney.money import Money
             total = Money(0, 'USD') # Initialize as Money object
-            for ri in self.recipe_ingredients.all():
+            for ri in resolve_ingredients(self.recipe_ingredients.all()):
                 resolved = ri.resolved_ingredient
                 if not resolved:
                     continue
-                total += (ri.quantity * resolved.cost_per_unit)
+                total += (ri.stock_quantity * resolved.cost_per_unit)
             return total
 
+    def update_cost(self, save=False):
+        self.cached_cost = self.calculate_cost()
+        if save:
+            self.save(update_fields=['cached_cost'])
+
     def __str__(self):
         return self.name
 
@@ -60,13 +329,44 @@ class RecipeIngredient(models.Model):
     ingredient_unit = models.ForeignKey(IngredientUnit, null=True, blank=True, on_delete=models.PROTECT)
     quantity = models.DecimalField(max_digits=6, decimal_places=2, help_text="Amount needed for this recipe")
 
+    class Meta:
+        indexes = [
+            # Lets cost propagation find free-text rows by Ingredient.name_key.
+            models.Index(name_key_expression('ingredient_name'), name='recipeingredient_name_key'),
+        ]
+
+    objects = RecipeIngredientQuerySet.as_manager()
+
     @cached_property
     def resolved_ingredient(self):
         if self.ingredient:
             return self.ingredient
-        if not self.ingredient_name:
+        key = normalize_ingredient_name(self.ingredient_name)
+        if not key:
+            return None
+        return Ingredient.objects.filter(name_key=key).order_by('pk').first()
+
+    @cached_property
+    def unit_factor(self):
+        """
+        Factor converting quantity into the resolved ingredient's stock
+        unit: 1 when the row has no unit of its own or it already matches,
+        None when no conversion is known (or nothing resolves).
+        """
+        resolved = self.resolved_ingredient
+        if not resolved:
             return None
-        return Ingredient.objects.filter(name__iexact=self.ingredient_name).first()
+        if self.ingredient_unit_id is None:
+            return Decimal('1')
+        return (
+            IngredientUnitFactor.objects.filter(ingredient=resolved, unit_id=self.ingredient_unit_id)
+            .values_list('factor', flat=True).first()
+        )
+
+    @property
+    def stock_quantity(self):
+        """quantity in the resolved ingredient's stock unit (unconverted when no factor is known)."""
+        return self.quantity * (self.unit_factor or Decimal('1'))
 
     @property
     def display_name(self):
@@ -74,19 +374,21 @@ class RecipeIngredient(models.Model):
 
     @property
     def display_unit(self):
+        if self.ingredient_unit:
+            return self.ingredient_unit.name
         resolved = self.resolved_ingredient
-        if resolved:
-            return resolved.unit_display
-        return self.ingredient_unit.name if self.ingredient_unit else ''
+        return resolved.unit_display if resolved else ''
 
     @property
     def missing_amount(self):
+        """Shortfall against the resolved ingredient's stock, in display_unit."""
         resolved = self.resolved_ingredient
         if not resolved:
             return self.quantity
-        if resolved.quantity >= self.quantity:
+        stock = resolved.quantity / (self.unit_factor or Decimal('1'))
+        if stock >= self.quantity:
             return Decimal('0')
-        return self.quantity - resolved.quantity
+        return self.quantity - stock
 
     @property
     def is_in_stock(self):
@@ -108,6 +410,16 @@ class Meal(models.Model):
         blank=True,
         help_text="Price displayed to customers"
     )
+    cached_cost = MoneyField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        default_currency='USD',
+        editable=False,
+        help_text="Materialized result of calculate_cost(), kept current by inventory.signals"
+    )
+
+    objects = MealQuerySet.as_manager()
     
     def calculate_cost(self):
         from djmoney.money import Money
@@ -116,6 +428,11 @@ class Meal(models.Model):
             total += (mr.recipe.calculate_cost() * mr.quantity)
         return total
 
+    def update_cost(self, save=False):
+        self.cached_cost = self.calculate_cost()
+        if save:
+            self.save(update_fields=['cached_cost'])
+
     def __str__(self):
         return f"{self.name} ({self.customer_price})"
     
@@ -124,8 +441,7 @@ class Meal(models.Model):
         from djmoney.money import Money
         # Use 0 if no price is set
         price = self.customer_price if self.customer_price else Money(0, 'USD')
-        cost = self.calculate_cost()
-        return price - cost
+        return price - self.cached_cost
 
 class MealRecipe(models.Model):
     """Links a Meal to a Recipe"""
@@ -134,4 +450,25 @@ class MealRecipe(models.Model):
     quantity = models.DecimalField(max_digits=6, decimal_places=2, default=1.0, help_text="Servings of this recipe")
 
     def __str__(self):
-        return f"{self.meal.name} -> {self.recipe.name}"
\ No newline at end of file
+        return f"{self.meal.name} -> {self.recipe.name}"
+
+class MealIngredientRequirement(models.Model):
+    """
+    One meal's flattened bill of materials: how much of each ingredient a
+    single serving needs, summed over its recipes. Rebuilt by
+    inventory.requirements whenever the meal's recipes change, so readers
+    never have to walk MealRecipe -> RecipeIngredient themselves.
+
+    Rows that resolve to an Ingredient (by foreign key or by name) point at
+    it and use its stock unit; rows that resolve to nothing keep their
+    free-text name and unit.
+    """
+    meal = models.ForeignKey(Meal, related_name='ingredient_requirements', on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, related_name='meal_requirements', on_delete=models.CASCADE, null=True, blank=True)
+    ingredient_name = models.CharField(max_length=100, blank=True)
+    unit = models.ForeignKey(IngredientUnit, null=True, blank=True, on_delete=models.PROTECT)
+    quantity = models.DecimalField(max_digits=14, decimal_places=4, help_text="Amount needed per serving of the meal")
+
+    def __str__(self):
+        name = self.ingredient.name if self.ingredient else self.ingredient_name
+        return f"{self.meal.name} - {self.quantity} {name}"
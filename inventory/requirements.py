@@ -0,0 +1,107 @@
+import math
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Min, Sum, Value, When
+from django.db.models.functions import Coalesce, Trim
+
+from .models import MealIngredientRequirement, RecipeIngredient, name_key_expression
+
+QUANTITY_FIELD = DecimalField(max_digits=14, decimal_places=4)
+
+
+def meal_requirement_rows(meal_ids=None):
+    """
+    Flattened per-serving requirements for every (or each given) meal, in
+    one GROUP BY query over RecipeIngredient x MealRecipe.
+
+    Returns (meal_id, ingredient_id, ingredient_name, unit_id, quantity)
+    tuples. Free-text rows resolve by name the same way as
+    RecipeIngredient.resolved_ingredient; resolved rows are converted into
+    the ingredient's stock unit through IngredientUnitFactor, the rest keep
+    their own unit and are grouped by normalized name, keeping one of the
+    names as written.
+    """
+    lookup = {'recipe__mealrecipe__meal_id__isnull': False}
+    if meal_ids is not None:
+        lookup['recipe__mealrecipe__meal_id__in'] = meal_ids
+    return (
+        RecipeIngredient.objects.filter(**lookup)
+        .alias(name_key=name_key_expression('ingredient_name'))
+        .exclude(ingredient__isnull=True, name_key='')
+        .with_resolution()
+        .annotate(
+            # Unresolved rows are grouped on the same normalized key they
+            # are matched on, so "Chives" and " chives" are one requirement.
+            free_key=Case(When(resolved_id__isnull=True, then='name_key'), default=Value('')),
+            # Rows with no known conversion stay in their own unit rather than
+            # being summed into the stock unit.
+            resolved_unit_id=Case(
+                When(unit_factor__isnull=False, then='stock_unit_id'),
+                default='ingredient_unit_id',
+                output_field=IntegerField(),
+            ),
+        )
+        .values('recipe__mealrecipe__meal_id', 'resolved_id', 'free_key', 'resolved_unit_id')
+        .annotate(
+            free_name=Min(Case(When(resolved_id__isnull=True, then=Trim('ingredient_name')), default=Value(''))),
+            total=Sum(
+                F('quantity') * Coalesce('unit_factor', Value(Decimal('1'))) * F('recipe__mealrecipe__quantity'),
+                output_field=QUANTITY_FIELD,
+            ),
+        )
+        .values_list('recipe__mealrecipe__meal_id', 'resolved_id', 'free_name', 'resolved_unit_id', 'total')
+    )
+
+
+def rebuild_meal_requirements(meal_ids=None, batch_size=500):
+    """
+    Replaces the MealIngredientRequirement rows of every (or each given)
+    meal in one transaction. Returns the number of rows written.
+    """
+    rows = [
+        MealIngredientRequirement(
+            meal_id=meal_id,
+            ingredient_id=ingredient_id,
+            ingredient_name=name,
+            unit_id=unit_id,
+            quantity=quantity,
+        )
+        for meal_id, ingredient_id, name, unit_id, quantity in meal_requirement_rows(meal_ids)
+    ]
+    stale = MealIngredientRequirement.objects.all()
+    if meal_ids is not None:
+        stale = stale.filter(meal_id__in=meal_ids)
+    with transaction.atomic():
+        stale.delete()
+        MealIngredientRequirement.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def max_servings(meal_ids=None):
+    """
+    {meal_id: servings} that current Ingredient.quantity can support for
+    every (or each given) meal: the min over its MealIngredientRequirement
+    rows of stock / per-serving quantity, floored, in one GROUP BY query.
+
+    Rows are judged the way RecipeIngredient.missing_amount judges them: a
+    requirement that resolves to no Ingredient has no stock, so its meal
+    can't be made at all. The same goes for one left in a unit with no
+    conversion to the ingredient's stock unit, as in stock_shortfalls().
+    Meals with no requirements are left out.
+    """
+    requirements = MealIngredientRequirement.objects.filter(quantity__gt=0)
+    if meal_ids is not None:
+        requirements = requirements.filter(meal_id__in=meal_ids)
+    rows = (
+        requirements.values('meal_id')
+        .annotate(servings=Min(
+            Case(
+                When(unit_id=F('ingredient__unit_id'), then=F('ingredient__quantity') / F('quantity')),
+                default=Value(Decimal('0')),
+            ),
+            output_field=QUANTITY_FIELD,
+        ))
+        .values_list('meal_id', 'servings')
+    )
+    return {meal_id: max(math.floor(servings), 0) for meal_id, servings in rows}
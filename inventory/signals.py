@@ -0,0 +1,73 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .costs import propagate_cost_changes, recipes_using_ingredient
+from .models import Ingredient, IngredientPriceHistory, MealRecipe, RecipeIngredient, UnitConversion
+from .units import rebuild_unit_factors, recipes_with_own_units
+
+
+@receiver(pre_save, sender=Ingredient)
+def remember_ingredient_pricing(sender, instance, **kwargs):
+    # Stash the stored name, cost and unit so post_save can tell whether
+    # any recipe cost or meal requirement actually depends on this write.
+    instance._previous_pricing = (
+        Ingredient.objects.filter(pk=instance.pk).values_list('name', 'cost_per_unit', 'unit_id').first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_pricing', None)
+    names = [instance.name]
+    if previous and not created:
+        previous_name, previous_cost, previous_unit_id = previous
+        cost_changed = previous_cost != instance.cost_per_unit.amount
+        # Renames change which free-text rows resolve here; either that or
+        # a unit change reshapes meal requirements.
+        unit_changed = previous_unit_id != instance.unit_id
+        requirements = previous_name != instance.name or unit_changed
+        if not (cost_changed or requirements):
+            return
+        names.append(previous_name)
+    else:
+        cost_changed = requirements = unit_changed = True
+    if unit_changed:
+        rebuild_unit_factors([instance.pk])
+    if cost_changed:
+        IngredientPriceHistory.objects.create(ingredient=instance, cost_per_unit=instance.cost_per_unit)
+    propagate_cost_changes(recipe_ids=recipes_using_ingredient(instance, names), requirements=requirements)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    # Linked rows cascade (and fire their own post_delete); free-text rows
+    # that resolved to this ingredient by name have to be found here.
+    propagate_cost_changes(recipe_ids=recipes_using_ingredient(None, [instance.name]))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    propagate_cost_changes(recipe_ids=[instance.recipe_id])
+
+
+@receiver(post_save, sender=MealRecipe)
+@receiver(post_delete, sender=MealRecipe)
+def meal_recipe_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    propagate_cost_changes(meal_ids=[instance.meal_id])
+
+
+@receiver(post_save, sender=UnitConversion)
+@receiver(post_delete, sender=UnitConversion)
+def unit_conversion_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rebuild_unit_factors()
+    propagate_cost_changes(recipe_ids=recipes_with_own_units())
@@ -1,3 +1,313 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from djmoney.money import Money
+
+from store.models import MenuItem, MenuWeek
+
+from .cost_engine import CostMatrix, costs_as_of
+from .linking import link_recipe_ingredients
+from .models import (
+    Ingredient,
+    IngredientUnit,
+    IngredientUnitFactor,
+    Meal,
+    MealRecipe,
+    Recipe,
+    RecipeIngredient,
+    UnitConversion,
+    resolve_ingredients,
+)
+
+
+class CostMatrixTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        pounds, _ = IngredientUnit.objects.get_or_create(name='Pounds')
+        ounces, _ = IngredientUnit.objects.get_or_create(name='Ounces')
+        cups, _ = IngredientUnit.objects.get_or_create(name='Cups')
+        butter = Ingredient.objects.create(name='Butter', unit=pounds, cost_per_unit=Money('4.35', 'USD'))
+        flour = Ingredient.objects.create(name='Flour', unit=pounds, cost_per_unit=Money('0.45', 'USD'))
+        potatoes = Ingredient.objects.create(name='Potatoes', unit=pounds, cost_per_unit=Money('1.10', 'USD'))
+
+        biscuits = Recipe.objects.create(name='Biscuits')
+        RecipeIngredient.objects.create(recipe=biscuits, ingredient=butter, quantity=Decimal('0.75'))
+        RecipeIngredient.objects.create(recipe=biscuits, ingredient=flour, quantity=Decimal('2.50'))
+        # Converted rows: generic ounces -> pounds, flour-specific cups -> pounds
+        # (through ounces), and a unit with no conversion at all.
+        UnitConversion.objects.create(from_unit=pounds, to_unit=ounces, factor=16)
+        UnitConversion.objects.create(from_unit=cups, to_unit=ounces, factor=Decimal('4.25'), ingredient=flour)
+        RecipeIngredient.objects.create(recipe=biscuits, ingredient=butter, ingredient_unit=ounces, quantity=Decimal('2.00'))
+        RecipeIngredient.objects.create(recipe=biscuits, ingredient_name='flour', ingredient_unit=cups, quantity=Decimal('1.50'))
+        RecipeIngredient.objects.create(recipe=biscuits, ingredient=potatoes, ingredient_unit=cups, quantity=Decimal('1.00'))
+        mash = Recipe.objects.create(name='Mashed Potatoes')
+        RecipeIngredient.objects.create(recipe=mash, ingredient=potatoes, quantity=Decimal('3.00'))
+        # Free-text rows: one resolves by name, one matches nothing.
+        RecipeIngredient.objects.create(recipe=mash, ingredient_name=' butter ', ingredient_unit=pounds, quantity=Decimal('0.33'))
+        RecipeIngredient.objects.create(recipe=mash, ingredient_name='Chives', ingredient_unit=pounds, quantity=Decimal('0.10'))
+        empty = Recipe.objects.create(name='Empty')
+
+        dinner = Meal.objects.create(name='Dinner', customer_price=Money('18.00', 'USD'))
+        MealRecipe.objects.create(meal=dinner, recipe=biscuits, quantity=Decimal('0.50'))
+        MealRecipe.objects.create(meal=dinner, recipe=mash, quantity=Decimal('1.25'))
+        sides = Meal.objects.create(name='Sides')
+        MealRecipe.objects.create(meal=sides, recipe=mash, quantity=Decimal('2.00'))
+        MealRecipe.objects.create(meal=sides, recipe=empty, quantity=Decimal('1.00'))
+        Meal.objects.create(name='Nothing Yet')
+
+    def test_matches_calculate_cost(self):
+        recipe_costs, meal_costs = CostMatrix.load().costs()
+
+        for recipe in Recipe.objects.all():
+            self.assertEqual(recipe_costs[recipe.pk], recipe.calculate_cost().amount, recipe.name)
+        for meal in Meal.objects.all():
+            self.assertEqual(meal_costs[meal.pk], meal.calculate_cost().amount, meal.name)
+
+    def test_sql_annotations_match_calculate_cost(self):
+        with self.assertNumQueries(1):
+            recipes = list(Recipe.objects.with_cost())
+        for recipe in recipes:
+            self.assertAlmostEqual(recipe.cost, recipe.calculate_cost().amount, places=6, msg=recipe.name)
+
+        with self.assertNumQueries(1):
+            meals = list(Meal.objects.with_cost_and_profit())
+        for meal in meals:
+            cost = meal.calculate_cost().amount
+            price = meal.customer_price.amount if meal.customer_price else 0
+            self.assertAlmostEqual(meal.cost, cost, places=6, msg=meal.name)
+            self.assertAlmostEqual(meal.profit, price - cost, places=6, msg=meal.name)
+
+    def test_resolve_ingredients_in_batches(self):
+        rows = list(RecipeIngredient.objects.select_related('ingredient'))
+        # One lookup for every free-text name, one for every unit factor.
+        with self.assertNumQueries(2):
+            resolve_ingredients(rows)
+        resolved = {
+            (ri.ingredient_name, ri.resolved_ingredient.name if ri.resolved_ingredient else None)
+            for ri in rows if not ri.ingredient_id
+        }
+        self.assertEqual(resolved, {('flour', 'Flour'), (' butter ', 'Butter'), ('Chives', None)})
+        with self.assertNumQueries(0):
+            resolve_ingredients(rows)
+            for ri in rows:
+                ri.resolved_ingredient
+
+    def test_unit_factors_follow_conversions(self):
+        def factors(name):
+            return dict(IngredientUnitFactor.objects.filter(ingredient__name=name).values_list('unit__name', 'factor'))
+
+        # Cups reach pounds through flour's own cups -> ounces conversion.
+        self.assertEqual(factors('Flour'), {'Pounds': 1, 'Ounces': Decimal('0.0625'), 'Cups': Decimal('0.265625')})
+        self.assertEqual(factors('Butter'), {'Pounds': 1, 'Ounces': Decimal('0.0625')})
+
+        kilograms, _ = IngredientUnit.objects.get_or_create(name='Kilograms')
+        pounds = IngredientUnit.objects.get(name='Pounds')
+        conversion = UnitConversion.objects.create(from_unit=kilograms, to_unit=pounds, factor=Decimal('2.20462'))
+        self.assertEqual(factors('Butter')['Kilograms'], Decimal('2.20462'))
+        conversion.delete()
+        self.assertNotIn('Kilograms', factors('Butter'))
+
+        rows = {
+            (ri.resolved_ingredient.name, ri.ingredient_unit.name): ri.unit_factor
+            for ri in RecipeIngredient.objects.filter(ingredient_unit__isnull=False, recipe__name='Biscuits')
+        }
+        self.assertEqual(rows, {
+            ('Butter', 'Ounces'): Decimal('0.0625'),
+            ('Flour', 'Cups'): Decimal('0.265625'),
+            ('Potatoes', 'Cups'): None,
+        })
+
+    def test_loads_in_constant_queries(self):
+        with self.assertNumQueries(5):
+            CostMatrix.load().costs()
+
+    def test_subset_matches_full_catalog(self):
+        dinner = Meal.objects.get(name='Dinner')
+        _, full = CostMatrix.load().costs()
+        _, subset = CostMatrix.load(meal_ids=[dinner.pk]).costs()
+        self.assertEqual(subset, {dinner.pk: full[dinner.pk]})
+
+
+class CachedCostTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pounds, _ = IngredientUnit.objects.get_or_create(name='Pounds')
+        cls.butter = Ingredient.objects.create(name='Butter', unit=cls.pounds, cost_per_unit=Money('2.00', 'USD'))
+        cls.biscuits = Recipe.objects.create(name='Biscuits')
+        RecipeIngredient.objects.create(recipe=cls.biscuits, ingredient=cls.butter, quantity=Decimal('1.5'))
+        # Free-text row that doesn't resolve until Flour exists.
+        RecipeIngredient.objects.create(
+            recipe=cls.biscuits, ingredient_name='flour', ingredient_unit=cls.pounds, quantity=Decimal('2'),
+        )
+        cls.dinner = Meal.objects.create(name='Dinner', customer_price=Money('10.00', 'USD'))
+        cls.dinner_biscuits = MealRecipe.objects.create(meal=cls.dinner, recipe=cls.biscuits, quantity=Decimal('2'))
+
+    def assertCachedCosts(self, recipe, meal):
+        self.biscuits.refresh_from_db()
+        self.dinner.refresh_from_db()
+        self.assertEqual(self.biscuits.cached_cost, Money(recipe, 'USD'))
+        self.assertEqual(self.dinner.cached_cost, Money(meal, 'USD'))
+
+    def test_saves_and_deletes_propagate(self):
+        self.assertCachedCosts('3.00', '6.00')
+
+        flour = Ingredient.objects.create(name='Flour', unit=self.pounds, cost_per_unit=Money('0.50', 'USD'))
+        self.assertCachedCosts('4.00', '8.00')
+        self.butter.cost_per_unit = Money('3.00', 'USD')
+        self.butter.save()
+        self.assertCachedCosts('5.50', '11.00')
+        flour.delete()
+        self.assertCachedCosts('4.50', '9.00')
+
+        row = self.biscuits.recipe_ingredients.get(ingredient=self.butter)
+        row.quantity = Decimal('1')
+        row.save()
+        self.assertCachedCosts('3.00', '6.00')
+        self.dinner_biscuits.quantity = Decimal('3')
+        self.dinner_biscuits.save()
+        self.assertCachedCosts('3.00', '9.00')
+        self.dinner_biscuits.delete()
+        self.assertCachedCosts('3.00', '0.00')
+
+    def test_deleting_ingredient_or_recipe_recosts(self):
+        self.butter.delete()
+        self.assertCachedCosts('0.00', '0.00')
+        MealRecipe.objects.create(meal=self.dinner, recipe=Recipe.objects.create(name='Gravy'), quantity=1)
+        self.biscuits.delete()
+        self.dinner.refresh_from_db()
+        self.assertEqual(self.dinner.cached_cost, Money('0.00', 'USD'))
+
+    def test_price_history_and_costs_as_of(self):
+        history = self.butter.price_history.all()
+        self.assertEqual(history.count(), 1)
+        created = timezone.now() - datetime.timedelta(days=7)
+        history.update(effective_at=created)
+
+        self.butter.quantity = Decimal('10')
+        self.butter.save()
+        self.assertEqual(history.count(), 1)
+        self.butter.cost_per_unit = Money('3.00', 'USD')
+        self.butter.save()
+        self.assertEqual(list(history.values_list('cost_per_unit', flat=True)), [Decimal('3.00'), Decimal('2.00')])
+
+        recipe_costs, meal_costs = costs_as_of(created + datetime.timedelta(days=1))
+        self.assertEqual((recipe_costs[self.biscuits.pk], meal_costs[self.dinner.pk]), (Decimal('3.00'), Decimal('6.00')))
+        _, meal_costs = costs_as_of(timezone.now(), meal_ids=[self.dinner.pk])
+        self.assertEqual(meal_costs, {self.dinner.pk: Decimal('9.00')})
+        # Before any recorded price the ingredient costs nothing.
+        _, meal_costs = costs_as_of(created - datetime.timedelta(days=1))
+        self.assertEqual(meal_costs[self.dinner.pk], 0)
+
+    def test_rebuild_costs_check(self):
+        call_command('rebuild_costs', '--check', stdout=StringIO())
+        Meal.objects.filter(pk=self.dinner.pk).update(cached_cost=Decimal('5.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_costs', '--check', stdout=StringIO())
+
+        call_command('rebuild_costs', stdout=StringIO())
+        call_command('rebuild_costs', '--check', stdout=StringIO())
+        self.assertCachedCosts('3.00', '6.00')
+
+
+class LinkRecipeIngredientsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pounds, _ = IngredientUnit.objects.get_or_create(name='Pounds')
+        cls.cups, _ = IngredientUnit.objects.get_or_create(name='Cups')
+        cls.flour = Ingredient.objects.create(name='Flour', unit=cls.pounds, cost_per_unit=Money('0.50', 'USD'))
+        biscuits = Recipe.objects.create(name='Biscuits')
+        for name, unit in (('flour', cls.pounds), (' FLOUR ', cls.cups), ('butter', cls.pounds), ('Chives', cls.cups)):
+            RecipeIngredient.objects.create(recipe=biscuits, ingredient_name=name, ingredient_unit=unit, quantity=1)
+
+    def test_dry_run_writes_nothing(self):
+        linked, unmatched = link_recipe_ingredients(dry_run=True)
+        self.assertEqual(len(linked), 2)
+        self.assertEqual(sorted(ri.ingredient_name for ri in unmatched), ['Chives', 'butter'])
+        self.assertEqual(RecipeIngredient.objects.filter(ingredient__isnull=True).count(), 4)
+
+    def test_links_in_chunks(self):
+        linked, unmatched = link_recipe_ingredients(chunk_size=1)
+        self.assertEqual(len(linked), 2)
+        self.assertEqual(len(unmatched), 2)
+        rows = RecipeIngredient.objects.filter(ingredient=self.flour)
+        # The stock unit is dropped; a different unit is kept for conversion.
+        self.assertEqual(
+            set(rows.values_list('ingredient_name', 'ingredient_unit_id')), {('', None), ('', self.cups.pk)},
+        )
+
+    def test_relink_command(self):
+        out = StringIO()
+        call_command('relink_recipe_ingredients', '--dry-run', stdout=out)
+        self.assertIn('Would link 2 recipe ingredient(s); 2 left unmatched.', out.getvalue())
+        call_command('relink_recipe_ingredients', stdout=out)
+        self.assertEqual(RecipeIngredient.objects.filter(ingredient__isnull=True).count(), 2)
+
+    def test_adding_an_ingredient_links_matching_rows(self):
+        staff = get_user_model().objects.create_user('chef', 'chef@example.com', 'pw', is_staff=True)
+        self.client.force_login(staff)
+        self.client.post(reverse('add_ingredient'), {
+            'name': 'BUTTER', 'quantity': '1', 'unit': self.pounds.pk,
+            'cost_per_unit_0': '2.00', 'cost_per_unit_1': 'USD',
+        })
+        butter = Ingredient.objects.get(name='BUTTER')
+        self.assertEqual(list(RecipeIngredient.objects.filter(ingredient=butter).values_list('ingredient_name', flat=True)), [''])
+        # Only rows matching the new name are touched.
+        self.assertEqual(RecipeIngredient.objects.filter(ingredient__isnull=True).count(), 3)
+
+
+class PriceSimulatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        pounds, _ = IngredientUnit.objects.get_or_create(name='Pounds')
+        butter = Ingredient.objects.create(name='Butter', unit=pounds, cost_per_unit=Money('2.00', 'USD'))
+        flour = Ingredient.objects.create(name='Flour', unit=pounds, cost_per_unit=Money('0.50', 'USD'))
+        biscuits = Recipe.objects.create(name='Biscuits')
+        RecipeIngredient.objects.create(recipe=biscuits, ingredient=butter, quantity=Decimal('1.5'))
+        RecipeIngredient.objects.create(recipe=biscuits, ingredient=flour, quantity=Decimal('2'))
+        dinner = Meal.objects.create(name='Dinner', customer_price=Money('10.00', 'USD'))
+        MealRecipe.objects.create(meal=dinner, recipe=biscuits, quantity=Decimal('2'))
+        Meal.objects.create(name='Sides')
+        week = MenuWeek.objects.create(name='Week 1', start_date=datetime.date(2025, 1, 6), is_active=True)
+        MenuItem.objects.create(menu_week=week, meal=dinner)
+        cls.staff = get_user_model().objects.create_user('chef', 'chef@example.com', 'pw', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_simulates_without_saving(self):
+        response = self.client.get(reverse('price_simulator'), {'changes': 'butter +10%,\nFLOUR $1/lb'})
+        # Butter 2.20 x 1.5 + flour 1.00 x 2, twice per dinner.
+        self.assertEqual(
+            [(row['name'], row['cost'], row['new_cost'], row['new_profit']) for row in response.context['menu_rows']],
+            [('Dinner', Decimal('8.00'), Decimal('10.60'), Decimal('-0.60'))],
+        )
+        sides = response.context['meal_rows'][1]
+        self.assertEqual((sides['name'], sides['cost_change']), ('Sides', 0))
+        self.assertEqual(Ingredient.objects.get(name='Butter').cost_per_unit, Money('2.00', 'USD'))
+
+    def test_menu_items_start_from_captured_prices(self):
+        # The meal has changed since the week captured $10.00 and $8.00.
+        Meal.objects.filter(name='Dinner').update(customer_price=Decimal('12.00'), cached_cost=Decimal('9.00'))
+        response = self.client.get(reverse('price_simulator'), {'changes': 'butter +10%,\nFLOUR $1/lb'})
+        row = response.context['menu_rows'][0]
+        self.assertEqual(
+            (row['price'], row['cost'], row['profit'], row['new_cost'], row['new_profit']),
+            (Decimal('10.00'), Decimal('8.00'), Decimal('2.00'), Decimal('10.60'), Decimal('-0.60')),
+        )
+        self.assertEqual(row['profit'], MenuItem.objects.get().projected_profit.amount)
+
+    def test_unknown_ingredient(self):
+        response = self.client.get(reverse('price_simulator'), {'changes': 'unobtainium +12%'})
+        self.assertFormError(response.context['form'], 'changes', 'No ingredient named "unobtainium".')
+        self.assertEqual(response.context['menu_rows'], [])
 
-# Create your tests here.
+    def test_blank_form(self):
+        response = self.client.get(reverse('price_simulator'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['meal_rows'], [])
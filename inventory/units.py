@@ -0,0 +1,76 @@
+from collections import deque
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import Ingredient, IngredientUnitFactor, RecipeIngredient, UnitConversion
+
+FACTOR_QUANTUM = Decimal('0.000000001')
+
+
+def _conversion_graphs():
+    """
+    (generic, {ingredient_id: own}) adjacency maps of {unit_id: {unit_id:
+    factor}} built from UnitConversion, each conversion in both directions.
+    """
+    generic, specific = {}, {}
+    for from_id, to_id, ingredient_id, factor in UnitConversion.objects.values_list(
+        'from_unit_id', 'to_unit_id', 'ingredient_id', 'factor',
+    ):
+        if from_id == to_id or factor <= 0:
+            continue
+        edges = specific.setdefault(ingredient_id, {}) if ingredient_id else generic
+        edges.setdefault(from_id, {})[to_id] = factor
+        edges.setdefault(to_id, {})[from_id] = 1 / factor
+    return generic, specific
+
+
+def factors_to(stock_unit_id, generic, own=None):
+    """
+    {unit_id: factor} taking a quantity in each reachable unit into
+    `stock_unit_id`, following the shortest chain of conversions. An
+    ingredient's `own` conversions win over generic ones for the same pair.
+    """
+    def neighbours(unit):
+        return {**generic.get(unit, {}), **(own or {}).get(unit, {})}
+
+    reached = {stock_unit_id: Decimal('1')}
+    queue = deque([stock_unit_id])
+    while queue:
+        unit = queue.popleft()
+        for source in neighbours(unit):
+            if source not in reached:
+                # 1 source = neighbours(source)[unit] units, each worth reached[unit] stock units.
+                reached[source] = neighbours(source)[unit] * reached[unit]
+                queue.append(source)
+    return {unit: factor.quantize(FACTOR_QUANTUM) for unit, factor in reached.items()}
+
+
+def rebuild_unit_factors(ingredient_ids=None, batch_size=500):
+    """
+    Replaces the IngredientUnitFactor rows of every (or each given)
+    ingredient in one transaction. Returns the number of rows written.
+    """
+    generic, specific = _conversion_graphs()
+    ingredients = Ingredient.objects.all()
+    if ingredient_ids is not None:
+        ingredients = ingredients.filter(pk__in=ingredient_ids)
+    rows = [
+        IngredientUnitFactor(ingredient_id=ingredient_id, unit_id=unit_id, factor=factor)
+        for ingredient_id, stock_unit_id in ingredients.values_list('pk', 'unit_id')
+        for unit_id, factor in factors_to(stock_unit_id, generic, specific.get(ingredient_id)).items()
+    ]
+    stale = IngredientUnitFactor.objects.all()
+    if ingredient_ids is not None:
+        stale = stale.filter(ingredient_id__in=ingredient_ids)
+    with transaction.atomic():
+        stale.delete()
+        IngredientUnitFactor.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def recipes_with_own_units():
+    """Ids of recipes with a row in a unit of its own: the only ones a conversion can affect."""
+    return set(
+        RecipeIngredient.objects.filter(ingredient_unit__isnull=False).values_list('recipe_id', flat=True)
+    )
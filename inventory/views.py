@@ -3,8 +3,13 @@ from django.http import JsonResponse
 from django.contrib.admin.views.decorators import staff_member_required
 
 # CORRECT: Import Meal from local models (Inventory), NOT Store
-from .models import Ingredient, IngredientUnit, Recipe, Meal
-from store.models import MenuItem, MenuWeek, OrderItem
+from .models import Ingredient, IngredientUnit, Recipe, Meal, resolve_ingredients
+from .linking import link_recipe_ingredients
+from .requirements import max_servings
+from .cost_engine import simulate_prices
+from .costs import deferred_propagation
+from store.models import MenuItem, MenuWeek, MenuWeekSales, OrderItem
+from store.requirements import stock_shortfalls
 
 from .forms import (
     IngredientForm,
@@ -13,6 +18,7 @@ from .forms import (
     RecipeIngredientFormSet,
     MealForm,
     MealRecipeFormSet,
+    PriceChangeForm,
 )
 from store.forms import MenuItemForm, MenuWeekForm 
 from djmoney.money import Money
@@ -23,12 +29,43 @@ def chef_dashboard(request):
     """The main command center for the Chef."""
     active_week = MenuWeek.objects.filter(is_active=True, is_archived=False).first()
     current_week = active_week or MenuWeek.objects.filter(is_archived=False).order_by('-start_date').first()
-    ingredients = Ingredient.objects.all()
+    ingredients = Ingredient.objects.select_related('unit')
     ingredient_total_value = Money(0, 'USD')
     for ingredient in ingredients:
         ingredient_total_value += ingredient.quantity * ingredient.cost_per_unit
     
-    menu_items = MenuItem.objects.filter(menu_week=current_week, meal__isnull=False).select_related('meal') if current_week else []
+    recipe_ingredients = ('recipe_ingredients__ingredient__unit', 'recipe_ingredients__ingredient_unit')
+    recipes = list(Recipe.objects.prefetch_related(*recipe_ingredients))
+    meals = list(Meal.objects.prefetch_related(*(f'meal_recipes__recipe__{path}' for path in recipe_ingredients)))
+    menu_items = list(
+        MenuItem.objects.filter(menu_week=current_week, meal__isnull=False)
+        .select_related('meal', 'sales')
+        .prefetch_related(*(f'meal__meal_recipes__recipe__{path}' for path in recipe_ingredients))
+    ) if current_week else []
+    # One lookup resolves every free-text ingredient the templates will show.
+    shown_rows = [ri for recipe in recipes for ri in recipe.recipe_ingredients.all()] + [
+        ri
+        for meal in meals + [item.meal for item in menu_items]
+        for mr in meal.meal_recipes.all()
+        for ri in mr.recipe.recipe_ingredients.all()
+    ]
+    resolve_ingredients(shown_rows)
+    # Stock is judged against the whole active week's demand, once, rather
+    # than row by row against each recipe's own quantity.
+    shortfalls = stock_shortfalls(active_week) if active_week else []
+    # An ingredient can be short in its stock unit and in a unit with no
+    # conversion at once; each row shows the shortfall of the unit it adds to.
+    short_by_ingredient = {(row['ingredient_id'], row['unit']): row for row in shortfalls if row['ingredient_id']}
+    for ri in shown_rows:
+        resolved = ri.resolved_ingredient
+        if resolved:
+            unit = resolved.unit.name if ri.unit_factor is not None else ri.ingredient_unit.name
+            ri.week_shortfall = short_by_ingredient.get((resolved.pk, unit))
+        else:
+            ri.week_shortfall = None
+    servings = max_servings([item.meal_id for item in menu_items])
+    for item in menu_items:
+        item.max_servings = servings.get(item.meal_id)
     archived_weeks = MenuWeek.objects.filter(is_archived=True).order_by('-start_date')
     order_items = (
         OrderItem.objects.select_related(
@@ -40,21 +77,18 @@ def chef_dashboard(request):
         if current_week
         else OrderItem.objects.none()
     )
-    order_totals = {
-        "total_price": Money(0, 'USD'),
-        "total_cost": Money(0, 'USD'),
-        "total_profit": Money(0, 'USD'),
-    }
-    for item in order_items:
-        order_totals["total_price"] += item.line_price
-        order_totals["total_cost"] += item.line_cost
-        order_totals["total_profit"] += item.line_profit
+    # Running counters (store.sales): one row, however many lines the week has.
+    week_sales = (
+        MenuWeekSales.objects.filter(menu_week=current_week).first() or MenuWeekSales(menu_week=current_week)
+        if current_week
+        else None
+    )
     context = {
         'ingredients': ingredients,
-        'recipes': Recipe.objects.all(),
+        'recipes': recipes,
         'menu_items': menu_items,
         'order_items': order_items,
-        'order_totals': order_totals,
+        'week_sales': week_sales,
         'active_week': active_week,
         'current_week': current_week,
         'archived_weeks': archived_weeks,
@@ -67,8 +101,9 @@ def chef_dashboard(request):
         'menu_item_form': MenuItemForm(initial={'menu_week': current_week}),
         'menu_week_form': MenuWeekForm(),
         'edit_menu_item_form': MenuItemForm(prefix='menu-edit'),
-        'meals': Meal.objects.all(),
+        'meals': meals,
         'ingredient_total_value': ingredient_total_value,
+        'shortfalls': shortfalls,
     }
     return render(request, 'inventory/dashboard.html', context)
 
@@ -78,6 +113,8 @@ def add_ingredient(request):
         form = IngredientForm(request.POST)
         if form.is_valid():
             ingredient = form.save()
+            # Rows typed in before this ingredient existed now point at it.
+            link_recipe_ingredients(names=[ingredient.name])
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                 return JsonResponse({
                     'id': ingredient.id,
@@ -97,7 +134,8 @@ def edit_ingredient(request, ingredient_id):
     if request.method == 'POST':
         form = IngredientForm(request.POST, instance=ingredient, prefix='edit')
         if form.is_valid():
-            form.save()
+            ingredient = form.save()
+            link_recipe_ingredients(names=[ingredient.name])
     return redirect('chef_dashboard')
 
 @staff_member_required
@@ -161,8 +199,9 @@ def manage_recipe(request, recipe_id=None):
         formset = RecipeIngredientFormSet(request.POST, instance=recipe)
         
         if form.is_valid() and formset.is_valid():
-            saved_recipe = form.save()
-            formset.save()
+            with deferred_propagation():
+                saved_recipe = form.save()
+                formset.save()
             return redirect('chef_dashboard')
     else:
         form = RecipeForm(instance=recipe)
@@ -197,18 +236,22 @@ def manage_meal(request, meal_id=None):
         formset = MealRecipeFormSet(request.POST, instance=meal)
         
         if form.is_valid() and formset.is_valid():
-            form.save()
-            formset.save()
+            with deferred_propagation():
+                form.save()
+                formset.save()
             return redirect('chef_dashboard')
     else:
         form = MealForm(instance=meal)
         formset = MealRecipeFormSet(instance=meal)
 
     recipe_costs = {
-        recipe.id: str(recipe.calculate_cost().amount)
-        for recipe in Recipe.objects.order_by('name')
+        recipe_id: str(round(cost, 2))
+        for recipe_id, cost in Recipe.objects.with_cost().order_by('name').values_list('id', 'cost')
     }
-    total_cost = meal.calculate_cost() if meal_id else None
+    total_cost = (
+        Money(Meal.objects.with_cost().values_list('cost', flat=True).get(pk=meal.pk), 'USD')
+        if meal_id else None
+    )
 
     return render(request, 'inventory/meal_editor.html', {
         'form': form,
@@ -222,4 +265,65 @@ def manage_meal(request, meal_id=None):
 def delete_meal(request, meal_id):
     meal = get_object_or_404(Meal, id=meal_id)
     meal.delete()
-    return redirect('chef_dashboard')
\ No newline at end of file
+    return redirect('chef_dashboard')
+
+@staff_member_required
+def price_simulator(request):
+    """
+    What-if pricing: shows how cost and projected profit of every Meal and
+    every MenuItem in the current week move under hypothetical ingredient
+    prices, without saving anything. Menu items are compared against the
+    price and cost captured for the week.
+    """
+    form = PriceChangeForm(request.GET or None)
+    meal_rows = []
+    menu_rows = []
+    current_week = (
+        MenuWeek.objects.filter(is_active=True, is_archived=False).first()
+        or MenuWeek.objects.filter(is_archived=False).order_by('-start_date').first()
+    )
+
+    if form.is_valid():
+        simulated = simulate_prices(form.cleaned_data['changes'])
+        meals = Meal.objects.order_by('name').only('name', 'customer_price', 'customer_price_currency')
+        rows_by_meal = {}
+        for meal in meals:
+            cost, new_cost = simulated[meal.pk]
+            price = meal.customer_price.amount if meal.customer_price else None
+            row = {
+                'name': meal.name,
+                'price': price,
+                'cost': cost,
+                'new_cost': new_cost,
+                'cost_change': new_cost - cost,
+                # Meal.projected_profit treats a missing price as 0.
+                'profit': (price or 0) - cost,
+                'new_profit': (price or 0) - new_cost,
+            }
+            rows_by_meal[meal.pk] = row
+            meal_rows.append(row)
+
+        if current_week:
+            items = current_week.items.filter(meal__isnull=False).values_list('meal_id', 'unit_price', 'unit_cost')
+            for meal_id, unit_price, unit_cost in items:
+                # Items start from the prices captured for the week, as
+                # MenuItem.projected_profit does; the simulated cost is what
+                # Refresh Prices would capture. No price, no profit.
+                new_cost = rows_by_meal[meal_id]['new_cost']
+                price = unit_price or None
+                menu_rows.append({
+                    'name': rows_by_meal[meal_id]['name'],
+                    'price': price,
+                    'cost': unit_cost,
+                    'new_cost': new_cost,
+                    'cost_change': new_cost - unit_cost,
+                    'profit': price - unit_cost if price is not None else None,
+                    'new_profit': price - new_cost if price is not None else None,
+                })
+
+    return render(request, 'inventory/price_simulator.html', {
+        'form': form,
+        'meal_rows': meal_rows,
+        'menu_rows': menu_rows,
+        'current_week': current_week,
+    })
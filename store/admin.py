@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import MenuWeek, MenuItem, Order, OrderItem
+from .models import MenuWeek, MenuItem, Order, OrderItem, PendingCheckout
 
 class MenuItemInline(admin.TabularInline):
     model = MenuItem
@@ -8,7 +8,7 @@ class MenuItemInline(admin.TabularInline):
 @admin.register(MenuWeek)
 class MenuWeekAdmin(admin.ModelAdmin):
     inlines = [MenuItemInline]
-    list_display = ('name', 'start_date', 'is_active')
+    list_display = ('name', 'start_date', 'is_active', 'admission_rate', 'admission_burst')
     list_editable = ('is_active',) # Quick toggle from the list view
 
 class OrderItemInline(admin.TabularInline):
@@ -19,4 +19,14 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline]
     list_display = ('id', 'customer', 'status', 'created_at')
-    list_filter = ('status', 'created_at')
\ No newline at end of file
+    list_filter = ('status', 'created_at')
+
+    def save_related(self, request, form, formsets, change):
+        # Re-total the order once for the whole inline formset, not per line.
+        with Order.defer_totals():
+            super().save_related(request, form, formsets, change)
+
+@admin.register(PendingCheckout)
+class PendingCheckoutAdmin(admin.ModelAdmin):
+    list_display = ('id', 'customer', 'menu_week', 'created_at', 'processed_at', 'error')
+    list_filter = ('processed_at',)
@@ -0,0 +1,80 @@
+"""
+Sliding-window admission control for drop openings.
+
+A MenuWeek with an admission_rate admits up to admission_burst requests
+per entry point ('home', 'checkout') in any window of burst / rate
+seconds: a burst at once, then admission_rate per second on average, like
+a token bucket of that size. The rest are sent to the waiting room with a
+Retry-After hint and never reach the database past the active-week
+lookup.
+
+A token bucket's refill is a read-modify-write the cache API can't do
+atomically, so the window is approximated from two fixed-window counters
+instead: the current window's count plus the previous window's, weighted
+by how much of it still overlaps the sliding window. The current counter
+is only moved with add(), incr() and decr(), each atomic in the cache
+itself, so racing requests can't take the same slot, and a request
+turned away gives its slot back.
+
+The counters are only shared by processes that share the cache: with the
+default per-process LocMemCache every worker (``--workers 4``) admits its
+own full rate. Deployments running more than one process need CACHES
+pointed at Redis or Memcached.
+"""
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+KEY_PREFIX = 'admission'
+
+
+def _window_key(menu_week, scope, window):
+    return f'{KEY_PREFIX}:{menu_week.pk}:{scope}:{window}'
+
+
+def _take(menu_week, scope, burst, length, now):
+    """
+    0 if the request fits in the sliding window ending at `now` (and is
+    counted), otherwise the seconds until one would.
+    """
+    window, elapsed = divmod(now / length, 1)
+    key = _window_key(menu_week, scope, int(window))
+    # Kept through the next window, where it is the previous one.
+    timeout = math.ceil(2 * length) + 1
+    cache.add(key, 0, timeout=timeout)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr(): this request opens it again.
+        cache.add(key, 1, timeout=timeout)
+        count = 1
+    previous = cache.get(_window_key(menu_week, scope, int(window) - 1), 0)
+    if previous * (1 - elapsed) + count <= burst:
+        return 0
+
+    cache.decr(key)
+    count -= 1
+    if count < burst and previous:
+        # Room opens as the previous window slides out.
+        wait = 1 - (burst - count - 1) / previous - elapsed
+    else:
+        # This window is full: wait for the next one to slide far enough past it.
+        wait = 1 - elapsed + max(0, 1 - (burst - 1) / count)
+    return max(math.ceil(wait * length), 1)
+
+
+async def admission_wait(menu_week, scope):
+    """
+    0 if a request to `scope` of `menu_week` is admitted (taking a slot in
+    the sliding window), otherwise the whole seconds until one frees up.
+    """
+    rate = menu_week.admission_rate
+    if not rate:
+        return 0
+    burst = menu_week.admission_burst or rate
+    # BaseCache.aincr() is a get then a set, so the backend's own incr()
+    # runs in a worker thread instead; thread_sensitive=False keeps
+    # concurrent checks from queueing on the one shared sync thread.
+    return await sync_to_async(_take, thread_sensitive=False)(menu_week, scope, burst, burst / rate, time.time())
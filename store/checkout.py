@@ -0,0 +1,276 @@
+"""
+Order placement.
+
+A checkout is a fixed number of queries however many lines it has: the
+requested MenuItems come from one in_bulk() scoped to the week, each line
+is priced from the unit_price/unit_cost its MenuItem captured for the
+week (no recipe is costed), the Order is inserted with its totals already
+summed and the OrderItems go in with one bulk_create(), so
+OrderItem.save()'s re-total never runs.
+
+A checkout carrying an idempotency key is placed at most once per
+customer: a repeat finds the first Order through the unique
+(customer, idempotency_key) index and writes nothing, and two racing
+submissions are settled by that same index.
+
+MenuItems with a capacity are reserved with one conditional UPDATE per
+line (sold = sold + n WHERE sold + n <= capacity), so concurrent
+checkouts never read-modify-write the counter and can't oversell it;
+uncapped items are counted with one UPDATE for the whole order. Lines
+saved or deleted one at a time afterwards (admin edits, cancelled lines,
+deleted orders) move sold through adjust_sold() from store.signals, so
+released servings can be sold again. The week and item sales counters
+(store.sales) take one more pair of writes each, however many lines.
+
+With settings.CHECKOUT_QUEUED on, checkout only validates the cart and
+records it as a PendingCheckout (one read, one small insert) so the
+request returns at once; the process_checkouts command places the queued
+carts in batches, one transaction per batch, instead of every request
+taking the database write lock for a whole order.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from djmoney.money import Money
+
+from .models import MenuItem, Order, OrderItem, PendingCheckout
+from .sales import SalesDelta
+
+logger = logging.getLogger(__name__)
+
+
+class SoldOut(Exception):
+    """Raised by place_order() when a line asks for more than a MenuItem has left."""
+
+    def __init__(self, menu_item):
+        super().__init__(f"{menu_item} is sold out.")
+        self.menu_item = menu_item
+
+
+def reserve(menu_item, quantity):
+    """
+    Atomically adds `quantity` to menu_item.sold unless that would pass its
+    capacity. Returns whether the servings were reserved.
+    """
+    return bool(
+        MenuItem.objects.filter(Q(capacity__isnull=True) | Q(capacity__gte=F('sold') + quantity), pk=menu_item.pk)
+        .update(sold=F('sold') + quantity)
+    )
+
+
+def reserve_lines(lines):
+    """
+    Reserves every OrderItem line's servings, raising SoldOut for the first
+    that can't be had. Capped items get a conditional UPDATE each; uncapped
+    ones are counted together in a single UPDATE. Call inside the
+    transaction that creates the lines so a refusal undoes the rest.
+    """
+    capped = [line for line in lines if line.menu_item.capacity is not None]
+    uncapped = [line for line in lines if line.menu_item.capacity is None]
+    # In pk order, so racing checkouts take the row locks in the same order.
+    for line in sorted(capped, key=lambda line: line.menu_item_id):
+        if not reserve(line.menu_item, line.quantity):
+            raise SoldOut(line.menu_item)
+    if uncapped:
+        counted = MenuItem.objects.filter(pk__in=[line.menu_item_id for line in uncapped], capacity__isnull=True).update(
+            sold=F('sold') + Case(
+                *(When(pk=line.menu_item_id, then=Value(line.quantity)) for line in uncapped),
+                output_field=IntegerField(),
+            ),
+        )
+        if counted != len(uncapped):
+            # A capacity was set since the items were read; reserve those against it.
+            newly_capped = set(
+                MenuItem.objects.filter(pk__in=[line.menu_item_id for line in uncapped], capacity__isnull=False)
+                .values_list('pk', flat=True)
+            )
+            for line in uncapped:
+                if line.menu_item_id in newly_capped and not reserve(line.menu_item, line.quantity):
+                    raise SoldOut(line.menu_item)
+
+
+def adjust_sold(deltas):
+    """
+    Adds signed {menu_item_id: servings} onto MenuItem.sold in one UPDATE,
+    never taking it below zero. Capacity isn't checked: this records lines
+    already written, it doesn't reserve for new ones.
+    """
+    deltas = {pk: n for pk, n in deltas.items() if pk is not None and n}
+    if not deltas:
+        return
+    MenuItem.objects.filter(pk__in=list(deltas)).update(
+        sold=Greatest(
+            F('sold') + Case(
+                *(When(pk=pk, then=Value(n)) for pk, n in deltas.items()),
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        ),
+    )
+
+
+def requested_quantities(data):
+    """{menu_item_id: quantity} from `item_<menu_item_id>=<quantity>` POST keys, ignoring junk and zeros."""
+    quantities = {}
+    for key, value in data.items():
+        if not key.startswith('item_'):
+            continue
+        try:
+            item_id = int(key.split('_')[1])
+            quantity = int(value)
+        except ValueError:
+            continue
+        if quantity > 0:
+            quantities[item_id] = quantity
+    return quantities
+
+
+def place_order(customer, menu_week, quantities, idempotency_key=None):
+    """
+    Creates a PENDING Order in `menu_week` for `customer` with one line per
+    {menu_item_id: quantity} entry, atomically. Items that aren't on that
+    week's menu are dropped; returns None when nothing is left to order.
+
+    If the customer already placed an order with `idempotency_key`, that
+    order is returned instead. Raises SoldOut, writing nothing, when a
+    line can't be reserved.
+    """
+    if idempotency_key:
+        existing = Order.objects.filter(customer=customer, idempotency_key=idempotency_key).first()
+        if existing:
+            return existing
+    menu_items = (
+        MenuItem.objects.filter(menu_week=menu_week, meal__isnull=False)
+        .select_related('meal')
+        .in_bulk(list(quantities))
+    )
+    if not menu_items:
+        return None
+
+    lines = []
+    for item_id, menu_item in menu_items.items():
+        line = OrderItem(menu_item=menu_item, quantity=quantities[item_id])
+        line.refresh_prices()
+        lines.append(line)
+
+    total_price = sum((line.line_price for line in lines), Money(0, 'USD'))
+    total_cost = sum((line.line_cost for line in lines), Money(0, 'USD'))
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(
+                customer=customer,
+                menu_week=menu_week,
+                status='PENDING',
+                total_price=total_price,
+                total_cost=total_cost,
+                total_profit=total_price - total_cost,
+                idempotency_key=idempotency_key,
+            )
+            for line in lines:
+                line.order = order
+            reserve_lines(lines)
+            OrderItem.objects.bulk_create(lines)
+            # bulk_create sends no signals; the order itself was counted on create.
+            sales = SalesDelta()
+            for line in lines:
+                sales.add_line(menu_week.pk, line.menu_item_id, line.quantity, line.line_price, line.line_cost)
+            sales.apply()
+    except IntegrityError:
+        if not idempotency_key:
+            raise
+        # A concurrent submission with the same key got there first.
+        return Order.objects.get(customer=customer, idempotency_key=idempotency_key)
+    return order
+
+
+def _orderable(menu_week, quantities):
+    """Ids of the requested MenuItems that are on `menu_week`'s menu and not sold out."""
+    return (
+        MenuItem.objects.filter(menu_week=menu_week, meal__isnull=False, pk__in=list(quantities))
+        .filter(Q(capacity__isnull=True) | Q(capacity__gt=F('sold')))
+        .values_list('pk', flat=True)
+    )
+
+
+def queue_checkout(customer, menu_week, quantities, idempotency_key=None):
+    """
+    Records the lines of the cart that are on `menu_week`'s menu and not
+    sold out as a PendingCheckout for process_pending_checkouts(). Returns
+    the row (the existing one for a repeated `idempotency_key`), or None
+    when nothing is left to order.
+    """
+    on_menu = set(_orderable(menu_week, quantities))
+    cart = {str(pk): quantity for pk, quantity in quantities.items() if pk in on_menu}
+    if not cart:
+        return None
+    if not idempotency_key:
+        return PendingCheckout.objects.create(customer=customer, menu_week=menu_week, quantities=cart)
+    pending, _ = PendingCheckout.objects.get_or_create(
+        customer=customer,
+        idempotency_key=idempotency_key,
+        defaults={'menu_week': menu_week, 'quantities': cart},
+    )
+    return pending
+
+
+async def aqueue_checkout(customer, menu_week, quantities, idempotency_key=None):
+    """queue_checkout() on the async ORM: intake needs no transaction, so it never leaves the event loop."""
+    on_menu = {pk async for pk in _orderable(menu_week, quantities)}
+    cart = {str(pk): quantity for pk, quantity in quantities.items() if pk in on_menu}
+    if not cart:
+        return None
+    if not idempotency_key:
+        return await PendingCheckout.objects.acreate(customer=customer, menu_week=menu_week, quantities=cart)
+    pending, _ = await PendingCheckout.objects.aget_or_create(
+        customer=customer,
+        idempotency_key=idempotency_key,
+        defaults={'menu_week': menu_week, 'quantities': cart},
+    )
+    return pending
+
+
+def process_pending_checkouts(batch_size=100):
+    """
+    Places up to `batch_size` queued checkouts, oldest first, in one
+    transaction; each goes through place_order() in its own savepoint.
+    Carts for a week that has since been closed or archived are refused.
+    Placed rows are deleted and the rest marked with their error, whatever
+    it was, so one bad cart can't stall the queue. Returns (placed, failed)
+    counts.
+    """
+    with transaction.atomic():
+        batch = list(
+            PendingCheckout.objects.filter(processed_at__isnull=True)
+            .select_related('customer', 'menu_week')
+            .order_by('pk')[:batch_size]
+        )
+        placed, failed = [], []
+        for pending in batch:
+            week = pending.menu_week
+            if week.is_archived or not week.is_active:
+                pending.error = "This week's menu closed before the order could be placed."
+                failed.append(pending)
+                continue
+            try:
+                quantities = {int(pk): quantity for pk, quantity in pending.quantities.items()}
+                with transaction.atomic():
+                    order = place_order(pending.customer, week, quantities, idempotency_key=pending.idempotency_key)
+            except SoldOut as exc:
+                pending.error = str(exc)
+            except Exception as exc:
+                logger.exception("Queued checkout %s could not be placed", pending.pk)
+                pending.error = f"Could not place the order: {exc}"[:255]
+            else:
+                if order is None:
+                    pending.error = "Nothing in the cart is on this week's menu."
+            (failed if pending.error else placed).append(pending)
+
+        now = timezone.now()
+        for pending in failed:
+            pending.processed_at = now
+        PendingCheckout.objects.bulk_update(failed, ['processed_at', 'error'])
+        PendingCheckout.objects.filter(pk__in=[pending.pk for pending in placed]).delete()
+    return len(placed), len(failed)
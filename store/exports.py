@@ -0,0 +1,109 @@
+"""
+Streaming CSV / NDJSON exports.
+
+Rows come from values_list() querysets read with .iterator(), so neither
+the queryset cache nor model instances are ever built: memory stays flat
+however many rows there are, and the first bytes go out as soon as the
+first chunk is fetched.
+
+Under ASGI, Django reads a sync iterator into a list before sending any of
+it, so there the lines are handed over as an async iterator instead, pulled
+CHUNK_SIZE at a time on the request's sync thread.
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, StreamingHttpResponse
+
+from .models import OrderItem
+from .requirements import quantize_quantity, recipe_servings_rows, requirement_rows
+
+CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+GROCERY_COLUMNS = ('ingredient_id', 'ingredient', 'unit', 'quantity')
+
+PREP_SHEET_COLUMNS = ('recipe_id', 'recipe', 'servings')
+
+ORDER_BOOK_COLUMNS = (
+    'order_id', 'ordered_at', 'status', 'customer', 'email', 'meal',
+    'quantity', 'unit_price', 'unit_cost', 'line_price', 'line_cost', 'line_profit',
+)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+async def _async_lines(lines):
+    # thread_sensitive (the default) keeps every batch on the thread the
+    # view ran in, and so on its database connection.
+    next_batch = sync_to_async(lambda: list(islice(lines, CHUNK_SIZE)))
+    while batch := await next_batch():
+        for line in batch:
+            yield line
+
+
+def stream_rows(request, columns, rows, fmt, filename):
+    """
+    StreamingHttpResponse of the row tuples in `rows` as CSV (with a header
+    row) or NDJSON (one object per line, keyed by `columns`).
+    """
+    if fmt not in CONTENT_TYPES:
+        raise Http404(f"Unknown export format {fmt!r}.")
+    lines = _csv_lines(columns, rows) if fmt == 'csv' else _ndjson_lines(columns, rows)
+    if isinstance(request, ASGIRequest):
+        lines = _async_lines(lines)
+    return StreamingHttpResponse(
+        lines,
+        content_type=CONTENT_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
+def grocery_list_rows(menu_week, statuses=('PAID',)):
+    """The week's ingredient requirements (see requirement_rows()), streamed."""
+    for ingredient_id, name, unit, qty in requirement_rows(menu_week, statuses).iterator(chunk_size=CHUNK_SIZE):
+        yield ingredient_id, name, unit, quantize_quantity(qty)
+
+
+def prep_sheet_rows(menu_week, statuses=('PAID',)):
+    """The week's per-recipe servings (see recipe_servings_rows()), streamed."""
+    for recipe_id, name, servings in recipe_servings_rows(menu_week, statuses).iterator(chunk_size=CHUNK_SIZE):
+        yield recipe_id, name, quantize_quantity(servings)
+
+
+def order_book_rows(menu_week):
+    """Every OrderItem in `menu_week`, one row per line, ordered by order."""
+    return (
+        OrderItem.objects.filter(menu_item__menu_week=menu_week)
+        .order_by('order_id', 'pk')
+        .values_list(
+            'order_id', 'order__created_at', 'order__status', 'order__customer_name', 'order__customer__email',
+            'meal_name', 'quantity', 'unit_price', 'unit_cost', 'line_price', 'line_cost', 'line_profit',
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
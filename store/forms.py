@@ -5,10 +5,11 @@ from inventory.models import Meal
 class MenuItemForm(forms.ModelForm):
     class Meta:
         model = MenuItem
-        fields = ['meal', 'menu_week']
+        fields = ['meal', 'menu_week', 'capacity']
         widgets = {
             'menu_week': forms.HiddenInput(),
             'meal': forms.Select(attrs={'class': 'form-input'}),
+            'capacity': forms.NumberInput(attrs={'class': 'form-input', 'min': 0, 'placeholder': 'No limit'}),
         }
 
     def __init__(self, *args, **kwargs):
@@ -20,8 +21,10 @@ class MenuItemForm(forms.ModelForm):
 class MenuWeekForm(forms.ModelForm):
     class Meta:
         model = MenuWeek
-        fields = ['name', 'start_date', 'is_active']
+        fields = ['name', 'start_date', 'is_active', 'admission_rate', 'admission_burst']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-input', 'placeholder': 'Week of Feb 10'}),
             'start_date': forms.DateInput(attrs={'class': 'form-input', 'type': 'date'}),
+            'admission_rate': forms.NumberInput(attrs={'class': 'form-input', 'min': 1, 'placeholder': 'No limit'}),
+            'admission_burst': forms.NumberInput(attrs={'class': 'form-input', 'min': 1, 'placeholder': 'Same as rate'}),
         }
\ No newline at end of file
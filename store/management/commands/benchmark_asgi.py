@@ -0,0 +1,102 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the ASGI and WSGI entry points serving many simultaneous slow clients, in process. "
+        "Each client takes --delay seconds to send its request and again to read each response chunk; "
+        "under WSGI that time is spent holding one of --workers threads, under ASGI it is spent awaiting. "
+        "Read-only: only GETs --path."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help="Simultaneous clients.")
+        parser.add_argument('--workers', type=int, default=8, help="WSGI worker threads.")
+        parser.add_argument('--delay', type=float, default=0.05, help="Seconds a slow client takes per read or write.")
+        parser.add_argument('--path', default='/', help="Page to request.")
+        parser.add_argument('--host', default='localhost', help="Host header; must be in ALLOWED_HOSTS.")
+
+    def handle(self, *args, **options):
+        self._report("wsgi", *self._run_wsgi(options))
+        self._report("asgi", *asyncio.run(self._run_asgi(options)))
+
+    def _run_wsgi(self, options):
+        """(requests, errors, seconds) for --clients requests served by --workers threads."""
+        application = get_wsgi_application()
+
+        def client(_):
+            environ = {'PATH_INFO': options['path'], 'HTTP_HOST': options['host']}
+            setup_testing_defaults(environ)
+            statuses = []
+            try:
+                # A sync worker reads the request itself, so the slow upload holds it too.
+                time.sleep(options['delay'])
+                body = application(environ, lambda status, headers: statuses.append(status))
+                try:
+                    for _chunk in body:
+                        time.sleep(options['delay'])
+                finally:
+                    body.close()
+            finally:
+                connection.close()
+            return statuses[0].startswith('200')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(client, range(options['clients'])))
+        return len(results), results.count(False), time.perf_counter() - started
+
+    async def _run_asgi(self, options):
+        """(requests, errors, seconds) for --clients requests on one event loop."""
+        application = get_asgi_application()
+
+        async def client():
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': options['path'],
+                'raw_path': options['path'].encode(),
+                'query_string': b'',
+                'headers': [(b'host', options['host'].encode())],
+                'client': ('127.0.0.1', 0),
+                'server': (options['host'], 80),
+            }
+            sent_request = False
+            statuses = []
+
+            async def receive():
+                nonlocal sent_request
+                if sent_request:
+                    # Nothing more to send; Django cancels this once the response is done.
+                    await asyncio.Event().wait()
+                sent_request = True
+                await asyncio.sleep(options['delay'])
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                else:
+                    await asyncio.sleep(options['delay'])
+
+            await application(scope, receive, send)
+            return statuses[0] == 200
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(client() for _ in range(options['clients'])))
+        return len(results), results.count(False), time.perf_counter() - started
+
+    def _report(self, label, count, errors, seconds):
+        rate = count / seconds if seconds else 0
+        self.stdout.write(f"{label:<6} {count:>6} requests  {seconds:8.3f}s  {rate:10.1f}/s  {errors} error(s)")
@@ -0,0 +1,82 @@
+import threading
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from djmoney.money import Money
+
+from inventory.models import Meal
+from store.checkout import place_order, process_pending_checkouts, queue_checkout
+from store.models import MenuItem, MenuWeek, Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare checkout throughput placing orders directly with queuing them for process_checkouts. "
+        "Creates its own menu week, meal and customers in the configured database and deletes them "
+        "afterwards; point it at a scratch copy, not production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help="Checkouts per mode.")
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent clients.")
+        parser.add_argument('--batch-size', type=int, default=100, help="Worker batch size for the queued mode.")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        week = MenuWeek.objects.create(name=f"Checkout benchmark {tag}", start_date='2000-01-03')
+        meal = Meal.objects.create(name=f"Checkout benchmark {tag}", customer_price=Money('10.00', 'USD'))
+        item = MenuItem.objects.create(menu_week=week, meal=meal)
+        User = get_user_model()
+        User.objects.bulk_create([User(username=f'bench-{tag}-{n}') for n in range(options['orders'])])
+        customers = list(User.objects.filter(username__startswith=f'bench-{tag}-'))
+        cart = {item.pk: 1}
+
+        try:
+            sync = self._run(customers, options['threads'], lambda customer: place_order(customer, week, cart))
+            Order.objects.filter(menu_week=week).delete()
+
+            intake = self._run(customers, options['threads'], lambda customer: queue_checkout(customer, week, cart))
+            started = time.perf_counter()
+            while any(process_pending_checkouts(options['batch_size'])):
+                pass
+            drain = time.perf_counter() - started
+        finally:
+            Order.objects.filter(menu_week=week).delete()
+            week.delete()
+            meal.delete()
+            User.objects.filter(username__startswith=f'bench-{tag}-').delete()
+
+        self._report("sync checkout", *sync)
+        self._report("queued intake", *intake)
+        self._report("queued worker", intake[0] - intake[1], 0, drain)
+        self._report("queued end-to-end", intake[0], intake[1], intake[2] + drain)
+
+    def _run(self, customers, threads, checkout):
+        """Runs `checkout` once per customer across `threads` threads: (attempts, errors, seconds)."""
+        errors = []
+        slices = [customers[n::threads] for n in range(threads)]
+
+        def client(batch):
+            try:
+                for customer in batch:
+                    try:
+                        checkout(customer)
+                    except DatabaseError:
+                        errors.append(customer)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=client, args=(batch,)) for batch in slices]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return len(customers), len(errors), time.perf_counter() - started
+
+    def _report(self, label, count, errors, seconds):
+        rate = count / seconds if seconds else 0
+        self.stdout.write(f"{label:<18} {count:>6} checkouts  {seconds:8.3f}s  {rate:10.1f}/s  {errors} error(s)")
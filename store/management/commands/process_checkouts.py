@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.checkout import process_pending_checkouts
+
+
+class Command(BaseCommand):
+    help = "Place queued checkouts (PendingCheckout rows) as orders, in batched transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Checkouts placed per transaction.")
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help="Keep polling for new checkouts instead of exiting once the queue is empty.",
+        )
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait between polls with --loop.")
+
+    def handle(self, *args, **options):
+        placed = failed = 0
+        while True:
+            batch_placed, batch_failed = process_pending_checkouts(options['batch_size'])
+            placed += batch_placed
+            failed += batch_failed
+            if batch_placed or batch_failed:
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"placed {batch_placed}, failed {batch_failed}")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Placed {placed} queued checkout(s); {failed} could not be placed."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the week and menu item sales counters from Order and OrderItem rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--week',
+            type=int,
+            action='append',
+            dest='weeks',
+            help="Only rebuild this MenuWeek id and its items (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        weeks, items = rebuild_sales(options['weeks'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales counters for {weeks} week(s) and {items} menu item(s)."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from store.models import MenuWeek
+from store.snapshots import summarize_menu_week
+
+
+class Command(BaseCommand):
+    help = "Freeze meal and grocery summaries for archived menu weeks that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help="Re-summarize every archived week, replacing existing summaries.",
+        )
+
+    def handle(self, *args, **options):
+        weeks = MenuWeek.objects.filter(is_archived=True).order_by('start_date')
+        if not options['all']:
+            weeks = weeks.filter(summarized_at__isnull=True)
+        count = 0
+        for week in weeks:
+            summarize_menu_week(week)
+            count += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f"summarized {week}")
+        self.stdout.write(self.style.SUCCESS(f"Summarized {count} archived week(s)."))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, help_text='Most servings this drop can sell; leave blank for no limit', null=True),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='sold',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Servings reserved by checkouts (see store.checkout)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_menuitem_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuweek',
+            name='admission_burst',
+            field=models.PositiveIntegerField(blank=True, help_text='Requests admitted at once before the rate applies; defaults to the rate', null=True),
+        ),
+        migrations.AddField(
+            model_name='menuweek',
+            name='admission_rate',
+            field=models.PositiveIntegerField(blank=True, help_text='Storefront and checkout requests admitted per second (see store.admission); leave blank for no limit', null=True),
+        ),
+    ]
@@ -1,7 +1,16 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.db import models
+from django.db.models import Sum
 from django.conf import settings  # To reference users.User
 from inventory.models import Meal
 from djmoney.models.fields import MoneyField
+from djmoney.money import Money
+
+# Order ids whose totals are waiting on Order.defer_totals() to exit.
+_dirty_orders = ContextVar('dirty_order_totals', default=None)
+
 class MenuWeek(models.Model):
     """Represents a specific 'Drop' or ordering window."""
     name = models.CharField(max_length=100, help_text="e.g., 'Week of Oct 10'")
@@ -9,6 +18,62 @@ class MenuWeek(models.Model):
     is_active = models.BooleanField(default=False, help_text="The Kill Switch. Only one week should be active at a time.")
     is_archived = models.BooleanField(default=False)
     archived_at = models.DateTimeField(null=True, blank=True)
+    summarized_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="When the week's meal and ingredient summaries were frozen (see store.snapshots)",
+    )
+    admission_rate = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Storefront and checkout requests admitted per second (see store.admission); leave blank for no limit",
+    )
+    admission_burst = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Requests admitted at once before the rate applies; defaults to the rate",
+    )
+
+    def save(self, *args, **kwargs):
+        activating = self.is_active and (
+            self._state.adding or not MenuWeek.objects.filter(pk=self.pk, is_active=True).exists()
+        )
+        super().save(*args, **kwargs)
+        if activating:
+            self.snapshot_prices()
+
+    def snapshot_prices(self, reprice_open_orders=False):
+        """
+        Captures every item's meal price and cost (Meal.cached_cost, kept
+        current by inventory.signals) onto the MenuItem, so checkout prices
+        lines without costing recipes. Runs when the week is activated; the
+        chef can re-run it, optionally re-costing the lines of the week's
+        PENDING orders too. Returns the number of items captured.
+        """
+        items = list(self.items.select_related('meal'))
+        for item in items:
+            item.capture_prices()
+        MenuItem.objects.bulk_update(items, ['unit_price', 'unit_cost'])
+        if reprice_open_orders:
+            from .sales import SalesDelta
+
+            lines = list(
+                OrderItem.objects.filter(menu_item__menu_week=self, order__status='PENDING')
+                .select_related('menu_item', 'order')
+            )
+            changed = [line for line in lines if line.unit_cost != line.menu_item.unit_cost]
+            sales = SalesDelta()
+            for line in changed:
+                sales.add_line(line.order.menu_week_id, line.menu_item_id, 0, 0, line.line_cost, sign=-1)
+                line.unit_cost = line.menu_item.unit_cost
+                line.line_cost = line.unit_cost * line.quantity
+                line.line_profit = line.line_price - line.line_cost
+                sales.add_line(line.order.menu_week_id, line.menu_item_id, 0, 0, line.line_cost)
+            OrderItem.objects.bulk_update(changed, ['unit_cost', 'line_cost', 'line_profit'])
+            Order.recompute_totals({line.order_id for line in changed})
+            sales.apply()
+        return len(items)
 
     def __str__(self):
         status = "ARCHIVED" if self.is_archived else ("ACTIVE" if self.is_active else "CLOSED")
@@ -18,14 +83,72 @@ class MenuItem(models.Model):
     """A specific meal being sold during a specific week."""
     menu_week = models.ForeignKey(MenuWeek, related_name='items', on_delete=models.CASCADE)
     meal = models.ForeignKey(Meal, on_delete=models.PROTECT, null=True, blank=True)
+    capacity = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Most servings this drop can sell; leave blank for no limit",
+    )
+    sold = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Servings reserved by checkouts (see store.checkout)",
+    )
+    unit_price = MoneyField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        default_currency='USD',
+        editable=False,
+        help_text="Meal price captured for this week (see MenuWeek.snapshot_prices)",
+    )
+    unit_cost = MoneyField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        default_currency='USD',
+        editable=False,
+        help_text="Meal cost captured for this week (see MenuWeek.snapshot_prices)",
+    )
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or MenuItem.objects.filter(pk=self.pk).exclude(meal_id=self.meal_id).exists():
+            if self.meal_id:
+                # cached_cost is maintained by queryset updates, so the meal in hand may be stale.
+                self.meal.refresh_from_db(
+                    fields=['customer_price', 'customer_price_currency', 'cached_cost', 'cached_cost_currency'],
+                )
+            self.capture_prices()
+        # sold only moves through store.checkout's UPDATEs (reserve() and
+        # adjust_sold()); saving an edited item must not write back a stale copy.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'sold'
+            ]
+        super().save(*args, **kwargs)
+
+    def capture_prices(self):
+        """Copies the meal's current price and cached cost onto the item (zero without a meal)."""
+        meal = self.meal
+        self.unit_price = meal.customer_price if meal and meal.customer_price else Money(0, 'USD')
+        self.unit_cost = meal.cached_cost if meal else Money(0, 'USD')
+
     @property
-    def projected_profit(self):
-        # Math now works automatically between Money objects
-        if not self.meal:
+    def remaining(self):
+        if self.capacity is None:
             return None
-        if not self.meal.customer_price:
+        return max(self.capacity - self.sold, 0)
+
+    @property
+    def is_sold_out(self):
+        return self.remaining == 0
+
+    @property
+    def projected_profit(self):
+        # From the captured prices, which is what this week's orders are charged.
+        if not self.meal or not self.unit_price:
             return None
-        return self.meal.customer_price - self.meal.calculate_cost()
+        return self.unit_price - self.unit_cost
     def __str__(self):
         if not self.meal:
             return "(Unassigned)"
@@ -50,6 +173,18 @@ class Order(models.Model):
     total_price = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
     total_cost = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
     total_profit = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Client token from the checkout form; a repeat submission returns this order",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'idempotency_key'], name='unique_order_idempotency_key'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.customer and not self.customer_name:
@@ -57,18 +192,60 @@ class Order(models.Model):
         super().save(*args, **kwargs)
 
     def update_totals(self, save=False):
-        from djmoney.money import Money
-        total_price = Money(0, 'USD')
-        total_cost = Money(0, 'USD')
-        for item in self.items.all():
-            total_price += item.line_price
-            total_cost += item.line_cost
-        self.total_price = total_price
-        self.total_cost = total_cost
-        self.total_profit = total_price - total_cost
+        """
+        Re-totals the order from one aggregate over its items. Inside
+        defer_totals() a saving re-total is put off until the block exits.
+        """
+        if save and self.pk:
+            dirty = _dirty_orders.get()
+            if dirty is not None:
+                dirty.add(self.pk)
+                return
+        price, cost = _item_totals([self.pk]).get(self.pk, (0, 0))
+        self.total_price = Money(price, 'USD')
+        self.total_cost = Money(cost, 'USD')
+        self.total_profit = self.total_price - self.total_cost
         if save:
             self.save(update_fields=['total_price', 'total_cost', 'total_profit'])
 
+    @classmethod
+    def recompute_totals(cls, order_ids):
+        """
+        Rewrites the totals of the given orders from one aggregate query and
+        one bulk_update. Returns the number of orders written.
+        """
+        order_ids = set(order_ids)
+        totals = _item_totals(order_ids)
+        orders = []
+        for pk in order_ids:
+            price, cost = totals.get(pk, (0, 0))
+            order = cls(pk=pk, total_price=Money(price, 'USD'), total_cost=Money(cost, 'USD'))
+            order.total_profit = order.total_price - order.total_cost
+            orders.append(order)
+        cls.objects.bulk_update(orders, ['total_price', 'total_cost', 'total_profit'], batch_size=500)
+        return len(orders)
+
+    @classmethod
+    @contextmanager
+    def defer_totals(cls):
+        """
+        Collects every order whose items are saved or deleted inside the
+        block and re-totals each one once on a clean exit, so editing ten
+        lines of an order re-totals it once rather than ten times. Nested
+        blocks join the outermost one.
+        """
+        if _dirty_orders.get() is not None:
+            yield
+            return
+        dirty = set()
+        token = _dirty_orders.set(dirty)
+        try:
+            yield
+        finally:
+            _dirty_orders.reset(token)
+        if dirty:
+            cls.recompute_totals(dirty)
+
     def __str__(self):
         return f"Order #{self.id} - {self.customer.username} ({self.status})"
 
@@ -84,21 +261,15 @@ class OrderItem(models.Model):
     line_profit = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
 
     def refresh_prices(self):
-        from djmoney.money import Money
-        meal = self.menu_item.meal if self.menu_item else None
-        if meal and meal.customer_price:
-            self.unit_price = meal.customer_price
-        else:
-            self.unit_price = Money(0, 'USD')
-        if meal:
-            self.unit_cost = meal.calculate_cost()
-        else:
-            self.unit_cost = Money(0, 'USD')
+        """Prices the line from its MenuItem's captured unit_price/unit_cost; no recipe is costed."""
+        menu_item = self.menu_item
+        self.unit_price = menu_item.unit_price
+        self.unit_cost = menu_item.unit_cost
         self.line_price = self.unit_price * self.quantity
         self.line_cost = self.unit_cost * self.quantity
         self.line_profit = self.line_price - self.line_cost
-        if meal and not self.meal_name:
-            self.meal_name = meal.name
+        if menu_item.meal_id and not self.meal_name:
+            self.meal_name = menu_item.meal.name
 
     def save(self, *args, **kwargs):
         self.refresh_prices()
@@ -106,7 +277,109 @@ class OrderItem(models.Model):
         if self.order_id:
             self.order.update_totals(save=True)
 
+    def delete(self, *args, **kwargs):
+        order = self.order
+        result = super().delete(*args, **kwargs)
+        order.update_totals(save=True)
+        return result
+
     def __str__(self):
         if not self.menu_item.meal:
             return f"{self.quantity}x (Unassigned)"
-        return f"{self.quantity}x {self.menu_item.meal.name}"
\ No newline at end of file
+        return f"{self.quantity}x {self.menu_item.meal.name}"
+
+class PendingCheckout(models.Model):
+    """
+    A validated cart waiting for the process_checkouts worker to turn it
+    into an Order (see store.checkout.queue_checkout). Rows are deleted once
+    their order is placed; a cart that can't be placed is kept with its
+    error so the customer can see why.
+    """
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='pending_checkouts', on_delete=models.CASCADE)
+    menu_week = models.ForeignKey(MenuWeek, related_name='pending_checkouts', on_delete=models.CASCADE)
+    quantities = models.JSONField(help_text="{menu_item_id: quantity}")
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'idempotency_key'], name='unique_pending_checkout_key'),
+        ]
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='pending_checkout_queue_idx'),
+        ]
+
+    def __str__(self):
+        state = "failed" if self.error else ("processed" if self.processed_at else "queued")
+        return f"Checkout #{self.pk} by {self.customer} ({state})"
+
+def _item_totals(order_ids):
+    """{order_id: (price, cost)} summed over the orders' items in one query, rounded to cents."""
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values('order_id')
+        .annotate(price=Sum('line_price'), cost=Sum('line_cost'))
+        .values_list('order_id', 'price', 'cost')
+    )
+    return {order_id: (round(price, 2), round(cost, 2)) for order_id, price, cost in rows}
+
+class MenuWeekSales(models.Model):
+    """
+    Running totals of the orders placed in a MenuWeek, any status, kept
+    current by store.sales so the dashboard reads one row instead of
+    summing every OrderItem.
+    """
+    menu_week = models.OneToOneField(MenuWeek, primary_key=True, related_name='sales', on_delete=models.CASCADE)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    cost = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    profit = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+
+    def __str__(self):
+        return f"{self.menu_week.name}: {self.orders} orders, {self.revenue}"
+
+class MenuItemSales(models.Model):
+    """Running totals of the order lines for a MenuItem (see MenuWeekSales); `orders` counts lines."""
+    menu_item = models.OneToOneField(MenuItem, primary_key=True, related_name='sales', on_delete=models.CASCADE)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    cost = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    profit = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+
+    def __str__(self):
+        return f"{self.menu_item}: {self.units} sold, {self.revenue}"
+
+class MenuWeekMealSummary(models.Model):
+    """Frozen per-meal sales and margin for an archived MenuWeek."""
+    menu_week = models.ForeignKey(MenuWeek, related_name='meal_summaries', on_delete=models.CASCADE)
+    meal = models.ForeignKey(Meal, null=True, blank=True, on_delete=models.SET_NULL)
+    meal_name = models.CharField(max_length=200)
+    units = models.PositiveIntegerField(default=0)
+    revenue = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    unit_cost = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    cost = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+    profit = MoneyField(max_digits=14, decimal_places=2, default=0, default_currency='USD')
+
+    class Meta:
+        ordering = ['meal_name']
+
+    def __str__(self):
+        return f"{self.menu_week.name}: {self.units}x {self.meal_name}"
+
+class MenuWeekIngredientSummary(models.Model):
+    """Frozen grocery list line for an archived MenuWeek."""
+    menu_week = models.ForeignKey(MenuWeek, related_name='ingredient_summaries', on_delete=models.CASCADE)
+    ingredient = models.ForeignKey('inventory.Ingredient', null=True, blank=True, on_delete=models.SET_NULL)
+    ingredient_name = models.CharField(max_length=100)
+    unit = models.CharField(max_length=50, blank=True)
+    quantity = models.DecimalField(max_digits=20, decimal_places=4)
+
+    class Meta:
+        ordering = ['ingredient_name', 'unit']
+
+    def __str__(self):
+        return f"{self.menu_week.name}: {self.quantity} {self.unit} {self.ingredient_name}"
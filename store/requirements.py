@@ -0,0 +1,140 @@
+"""
+Ingredient demand for a MenuWeek, computed in the database.
+
+Each meal's per-serving bill of materials is kept flattened in
+MealIngredientRequirement, so demand is one join from OrderItem to that
+table: requirement.quantity * item.quantity, summed per ingredient and unit
+in a single GROUP BY. stock_shortfalls() sets the same totals against the
+pantry; recipe_servings_rows() totals servings per Recipe the same way.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Min, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from inventory.models import MealIngredientRequirement, MealRecipe, name_key_expression
+
+QUANTITY_FIELD = DecimalField(max_digits=20, decimal_places=4)
+QUANTUM = Decimal('0.0001')
+
+# MealIngredientRequirement / MealRecipe -> OrderItem path, through the
+# meal's menu items.
+ORDERED_VIA = 'meal__menuitem'
+
+
+def _ordered_in(menu_week, statuses):
+    """Filter kwargs keeping per-meal rows ordered in `menu_week` by orders in `statuses`."""
+    return {
+        f'{ORDERED_VIA}__menu_week': menu_week,
+        f'{ORDERED_VIA}__orderitem__order__status__in': statuses,
+    }
+
+
+def _demand(menu_week, statuses):
+    """
+    MealIngredientRequirement rows ordered in `menu_week`, grouped per
+    ingredient (free-text ones by normalized name) and unit.
+    """
+    return (
+        MealIngredientRequirement.objects.filter(**_ordered_in(menu_week, statuses))
+        .annotate(name_key=name_key_expression('ingredient_name'), unit_name=Coalesce('unit__name', Value('')))
+        .values('ingredient_id', 'name_key', 'unit_name')
+        .annotate(
+            name=Coalesce(Min('ingredient__name'), Min('ingredient_name')),
+            qty=Sum(F('quantity') * F(f'{ORDERED_VIA}__orderitem__quantity'), output_field=QUANTITY_FIELD),
+        )
+        .order_by('name', 'unit_name')
+    )
+
+
+def requirement_rows(menu_week, statuses=('PAID',)):
+    """
+    (ingredient_id, name, unit, qty) rows for every ingredient the orders of
+    `menu_week` in `statuses` need, sorted by name, as one GROUP BY query.
+
+    Requirements that resolve to no Ingredient keep their free-text name
+    and unit with ingredient_id None. SQLite returns computed decimals via
+    float, so pass qty through quantize_quantity() before showing it.
+    """
+    return _demand(menu_week, statuses).values_list('ingredient_id', 'name', 'unit_name', 'qty')
+
+
+def recipe_servings_rows(menu_week, statuses=('PAID',)):
+    """
+    (recipe_id, name, servings) rows for every recipe the orders of
+    `menu_week` in `statuses` need, sorted by name, as one GROUP BY query:
+    MealRecipe.quantity * OrderItem.quantity summed across every meal that
+    includes the recipe. Quantize servings like requirement_rows() qty.
+    """
+    return (
+        MealRecipe.objects.filter(**_ordered_in(menu_week, statuses))
+        .values('recipe_id')
+        .annotate(
+            name=F('recipe__name'),
+            servings=Sum(F('quantity') * F(f'{ORDERED_VIA}__orderitem__quantity'), output_field=QUANTITY_FIELD),
+        )
+        .order_by('name', 'recipe_id')
+        .values_list('recipe_id', 'name', 'servings')
+    )
+
+
+def quantize_quantity(qty):
+    return qty.quantize(QUANTUM)
+
+
+def ingredient_requirements(menu_week, statuses=('PAID',)):
+    """requirement_rows() as a list of {'ingredient_id', 'name', 'unit', 'qty'} dicts."""
+    return [
+        {'ingredient_id': ingredient_id, 'name': name, 'unit': unit, 'qty': quantize_quantity(qty)}
+        for ingredient_id, name, unit, qty in requirement_rows(menu_week, statuses)
+    ]
+
+
+def recipe_servings(menu_week, statuses=('PAID',)):
+    """recipe_servings_rows() as a list of {'recipe_id', 'name', 'servings'} dicts."""
+    return [
+        {'recipe_id': recipe_id, 'name': name, 'servings': quantize_quantity(servings)}
+        for recipe_id, name, servings in recipe_servings_rows(menu_week, statuses)
+    ]
+
+
+def stock_shortfalls(menu_week, statuses=('PENDING', 'PAID')):
+    """
+    [{'ingredient_id', 'name', 'unit', 'needed', 'in_stock', 'short', 'cost'}]
+    for every ingredient the open orders of `menu_week` need more of than
+    the pantry holds, in one GROUP BY query.
+
+    Demand is totalled across the whole week before it is compared with
+    Ingredient.quantity, so two meals drawing on the same stock are not each
+    judged against all of it. Requirements that resolve to no Ingredient, or
+    stay in a unit with no conversion to its stock unit, can't be checked
+    against the pantry: in_stock and cost are None and the whole need is
+    short.
+    """
+    rows = _demand(menu_week, statuses).annotate(
+        in_stock=Case(
+            When(unit_id=F('ingredient__unit_id'), then='ingredient__quantity'),
+            output_field=QUANTITY_FIELD,
+        ),
+        cost_per_unit=Case(
+            When(unit_id=F('ingredient__unit_id'), then='ingredient__cost_per_unit'),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+    ).values_list('ingredient_id', 'name', 'unit_name', 'qty', 'in_stock', 'cost_per_unit')
+
+    shortfalls = []
+    for ingredient_id, name, unit, qty, in_stock, cost_per_unit in rows:
+        needed = quantize_quantity(qty)
+        short = needed - in_stock if in_stock is not None else needed
+        if short <= 0:
+            continue
+        shortfalls.append({
+            'ingredient_id': ingredient_id,
+            'name': name,
+            'unit': unit,
+            'needed': needed,
+            'in_stock': in_stock,
+            'short': short,
+            'cost': round(short * cost_per_unit, 2) if cost_per_unit is not None else None,
+        })
+    return shortfalls
@@ -0,0 +1,147 @@
+"""
+Incrementally maintained sales counters.
+
+MenuWeekSales and MenuItemSales hold order count, units, revenue, cost and
+profit, so the dashboard reads one row per week and per item instead of
+summing OrderItems. A week's counters cover the orders placed in it
+(Order.menu_week); an item's cover the lines that ordered it.
+
+Every writer adds signed deltas with F() updates in the transaction that
+writes the rows they describe: store.signals for single saves and deletes
+(cascades included), place_order() for its bulk_create and
+MenuWeek.snapshot_prices() for repriced lines. Queryset update() and
+bulk writes elsewhere bypass them; rebuild_sales() (``manage.py
+reconcile_sales``) recomputes the counters from scratch.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Sum, Value, When
+from djmoney.money import Money
+
+from .models import MenuItemSales, MenuWeekSales, Order, OrderItem
+
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _amount(value):
+    return value.amount if isinstance(value, Money) else Decimal(value)
+
+
+def _zero():
+    # [orders, units, revenue, cost]
+    return [0, 0, Decimal('0'), Decimal('0')]
+
+
+class SalesDelta:
+    """Signed counter changes, summed per week and per item until apply()."""
+
+    def __init__(self):
+        self.weeks = defaultdict(_zero)
+        self.items = defaultdict(_zero)
+
+    def add_orders(self, menu_week_id, count):
+        self.weeks[menu_week_id][0] += count
+
+    def add_line(self, menu_week_id, menu_item_id, quantity, line_price, line_cost, sign=1):
+        """
+        Counts (sign=1) or uncounts (sign=-1) one order line for its week and,
+        unless `menu_item_id` is None, its item.
+        """
+        targets = [(self.weeks[menu_week_id], 0)]
+        if menu_item_id is not None:
+            targets.append((self.items[menu_item_id], sign))
+        for delta, orders in targets:
+            delta[0] += orders
+            delta[1] += sign * quantity
+            delta[2] += sign * _amount(line_price)
+            delta[3] += sign * _amount(line_cost)
+
+    def apply(self, create=True):
+        """
+        Writes the deltas: at most two queries per counter table. With
+        `create` off, missing counter rows are left missing; delete paths
+        use that, as the week or item may be going away in the same cascade.
+        """
+        _add_to_counters(MenuWeekSales, self.weeks, create)
+        _add_to_counters(MenuItemSales, self.items, create)
+
+
+def _add_to_counters(model, deltas, create=True):
+    """Adds {pk: [orders, units, revenue, cost]} onto `model` rows, creating missing ones if `create`."""
+    deltas = {pk: delta for pk, delta in deltas.items() if pk is not None and any(delta)}
+    if not deltas:
+        return
+    if create:
+        model.objects.bulk_create([model(pk=pk) for pk in deltas], ignore_conflicts=True)
+
+    def bumped(field, amount_of, output_field):
+        # A Case at the top level, so django-money passes it through as is.
+        return Case(
+            *(When(pk=pk, then=F(field) + Value(amount_of(delta))) for pk, delta in deltas.items()),
+            default=F(field),
+            output_field=output_field,
+        )
+
+    model.objects.filter(pk__in=list(deltas)).update(
+        orders=bumped('orders', lambda delta: delta[0], IntegerField()),
+        units=bumped('units', lambda delta: delta[1], IntegerField()),
+        revenue=bumped('revenue', lambda delta: delta[2], AMOUNT_FIELD),
+        cost=bumped('cost', lambda delta: delta[3], AMOUNT_FIELD),
+        profit=bumped('profit', lambda delta: delta[2] - delta[3], AMOUNT_FIELD),
+    )
+
+
+def _counter(model, pk, orders, units, revenue, cost):
+    revenue, cost = round(revenue or 0, 2), round(cost or 0, 2)
+    return model(
+        pk=pk,
+        orders=orders,
+        units=units or 0,
+        revenue=Money(revenue, 'USD'),
+        cost=Money(cost, 'USD'),
+        profit=Money(revenue - cost, 'USD'),
+    )
+
+
+def rebuild_sales(menu_week_ids=None, batch_size=500):
+    """
+    Replaces the counters of every (or each given) week and its items with
+    totals aggregated from Order and OrderItem rows, in one transaction.
+    Returns (weeks written, items written).
+    """
+    orders = Order.objects.filter(menu_week__isnull=False)
+    week_lines = OrderItem.objects.filter(order__menu_week__isnull=False)
+    item_lines = OrderItem.objects.all()
+    stale_weeks, stale_items = MenuWeekSales.objects.all(), MenuItemSales.objects.all()
+    if menu_week_ids is not None:
+        orders = orders.filter(menu_week_id__in=menu_week_ids)
+        week_lines = week_lines.filter(order__menu_week_id__in=menu_week_ids)
+        item_lines = item_lines.filter(menu_item__menu_week_id__in=menu_week_ids)
+        stale_weeks = stale_weeks.filter(menu_week_id__in=menu_week_ids)
+        stale_items = stale_items.filter(menu_item__menu_week_id__in=menu_week_ids)
+
+    order_counts = dict(orders.values('menu_week_id').annotate(n=Count('pk')).values_list('menu_week_id', 'n'))
+    line_totals = {
+        week_id: (units, revenue, cost)
+        for week_id, units, revenue, cost in week_lines.values('order__menu_week_id')
+        .annotate(units=Sum('quantity'), revenue=Sum('line_price'), cost=Sum('line_cost'))
+        .values_list('order__menu_week_id', 'units', 'revenue', 'cost')
+    }
+    weeks = [
+        _counter(MenuWeekSales, week_id, order_counts.get(week_id, 0), *line_totals.get(week_id, (0, 0, 0)))
+        for week_id in order_counts.keys() | line_totals.keys()
+    ]
+    items = [
+        _counter(MenuItemSales, *row)
+        for row in item_lines.values('menu_item_id')
+        .annotate(orders=Count('pk'), units=Sum('quantity'), revenue=Sum('line_price'), cost=Sum('line_cost'))
+        .values_list('menu_item_id', 'orders', 'units', 'revenue', 'cost')
+    ]
+    with transaction.atomic():
+        stale_weeks.delete()
+        stale_items.delete()
+        MenuWeekSales.objects.bulk_create(weeks, batch_size=batch_size)
+        MenuItemSales.objects.bulk_create(items, batch_size=batch_size)
+    return len(weeks), len(items)
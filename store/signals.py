@@ -0,0 +1,90 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .checkout import adjust_sold
+from .models import Order, OrderItem
+from .sales import SalesDelta
+
+
+@receiver(pre_save, sender=OrderItem)
+def remember_order_item_sales(sender, instance, **kwargs):
+    # Stash what the stored row counted for, so post_save can swap it for
+    # the new values rather than counting the line twice.
+    instance._previous_sales = (
+        OrderItem.objects.filter(pk=instance.pk)
+        .values_list('order__menu_week_id', 'menu_item_id', 'quantity', 'line_price', 'line_cost')
+        .first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    delta = SalesDelta()
+    servings = {instance.menu_item_id: instance.quantity}
+    previous = getattr(instance, '_previous_sales', None)
+    if previous:
+        delta.add_line(*previous, sign=-1)
+        # A lowered quantity or a swapped item gives servings back.
+        _, menu_item_id, quantity, _, _ = previous
+        servings[menu_item_id] = servings.get(menu_item_id, 0) - quantity
+    delta.add_line(
+        instance.order.menu_week_id, instance.menu_item_id, instance.quantity, instance.line_price, instance.line_cost,
+    )
+    delta.apply()
+    adjust_sold(servings)
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    # Lines are deleted before their order when it cascades, so the order
+    # row is still there to say which week the line counted for. A cascade
+    # from a MenuItem has already deleted its counter, and a new one would
+    # point at the item being deleted: only existing counters are updated.
+    menu_week_id = Order.objects.filter(pk=instance.order_id).values_list('menu_week_id', flat=True).first()
+    delta = SalesDelta()
+    delta.add_line(
+        menu_week_id, instance.menu_item_id, instance.quantity, instance.line_price, instance.line_cost, sign=-1,
+    )
+    delta.apply(create=False)
+    adjust_sold({instance.menu_item_id: -instance.quantity})
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_week(sender, instance, update_fields=None, **kwargs):
+    # Totals-only saves (Order.update_totals) can't move the order. The
+    # week is wrapped in a tuple so "no week" isn't mistaken for "not looked".
+    moving = instance.pk and (update_fields is None or 'menu_week' in update_fields)
+    instance._previous_menu_week = (
+        tuple(Order.objects.filter(pk=instance.pk).values_list('menu_week_id', flat=True)) if moving else None
+    )
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    delta = SalesDelta()
+    if created:
+        delta.add_orders(instance.menu_week_id, 1)
+    else:
+        previous = getattr(instance, '_previous_menu_week', None)
+        if not previous or previous[0] == instance.menu_week_id:
+            return
+        previous = previous[0]
+        # The order moved weeks: its lines' totals go with it.
+        delta.add_orders(previous, -1)
+        delta.add_orders(instance.menu_week_id, 1)
+        for quantity, line_price, line_cost in instance.items.values_list('quantity', 'line_price', 'line_cost'):
+            delta.add_line(previous, None, quantity, line_price, line_cost, sign=-1)
+            delta.add_line(instance.menu_week_id, None, quantity, line_price, line_cost)
+    delta.apply()
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    delta = SalesDelta()
+    delta.add_orders(instance.menu_week_id, -1)
+    delta.apply(create=False)
@@ -0,0 +1,132 @@
+"""
+Per-week sales, margin and grocery summaries.
+
+While a week is open these are computed from live data. Archiving freezes
+them into MenuWeekMealSummary / MenuWeekIngredientSummary rows so later
+recipe or price edits can't rewrite a closed week's numbers, and archived
+week pages read a handful of precomputed rows instead of re-aggregating.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from djmoney.money import Money
+
+from inventory.cost_engine import costs_as_of
+from .models import MenuWeekIngredientSummary, MenuWeekMealSummary, OrderItem
+from .requirements import ingredient_requirements
+
+# Orders that count as sales; PENDING orders were never paid for.
+SOLD_STATUSES = ('PAID', 'FULFILLED')
+
+
+def meal_margins(menu_week, priced_at):
+    """
+    [{'meal_id', 'name', 'units', 'revenue', 'unit_cost', 'cost', 'profit'}]
+    for each meal sold in `menu_week`, with meal costs priced from
+    ingredient price history as of `priced_at`.
+    """
+    sales = list(
+        OrderItem.objects.filter(
+            menu_item__menu_week=menu_week,
+            menu_item__meal__isnull=False,
+            order__status__in=SOLD_STATUSES,
+        )
+        .values('menu_item__meal_id', 'menu_item__meal__name')
+        .annotate(units=Sum('quantity'), revenue=Sum('line_price'))
+        .order_by('menu_item__meal__name')
+    )
+    _, meal_costs = costs_as_of(priced_at, meal_ids=[row['menu_item__meal_id'] for row in sales])
+
+    rows = []
+    for row in sales:
+        unit_cost = round(meal_costs[row['menu_item__meal_id']], 2)
+        cost = unit_cost * row['units']
+        rows.append({
+            'meal_id': row['menu_item__meal_id'],
+            'name': row['menu_item__meal__name'],
+            'units': row['units'],
+            'revenue': row['revenue'],
+            'unit_cost': unit_cost,
+            'cost': cost,
+            'profit': row['revenue'] - cost,
+        })
+    return rows
+
+
+def week_summary(menu_week):
+    """
+    (meal rows, grocery rows) for `menu_week`: the frozen summaries once it
+    has been archived and summarized, otherwise computed live (priced as of
+    archived_at, or now).
+    """
+    if menu_week.summarized_at:
+        meals = [
+            {
+                'meal_id': summary.meal_id,
+                'name': summary.meal_name,
+                'units': summary.units,
+                'revenue': summary.revenue.amount,
+                'unit_cost': summary.unit_cost.amount,
+                'cost': summary.cost.amount,
+                'profit': summary.profit.amount,
+            }
+            for summary in menu_week.meal_summaries.all()
+        ]
+        groceries = [
+            {'ingredient_id': ingredient_id, 'name': name, 'unit': unit, 'qty': qty}
+            for ingredient_id, name, unit, qty in menu_week.ingredient_summaries.values_list(
+                'ingredient_id', 'ingredient_name', 'unit', 'quantity',
+            )
+        ]
+        return meals, groceries
+    priced_at = menu_week.archived_at or timezone.now()
+    return meal_margins(menu_week, priced_at), ingredient_requirements(menu_week, SOLD_STATUSES)
+
+
+def summary_totals(meals):
+    totals = {'units': 0, 'revenue': Decimal('0'), 'cost': Decimal('0')}
+    for row in meals:
+        totals['units'] += row['units']
+        totals['revenue'] += row['revenue']
+        totals['cost'] += row['cost']
+    totals['profit'] = totals['revenue'] - totals['cost']
+    return totals
+
+
+def summarize_menu_week(menu_week):
+    """
+    Computes and stores the week's meal margins and grocery list, replacing
+    any earlier summary, in one transaction. Call it when the week is
+    archived; archived_at must already be set.
+    """
+    priced_at = menu_week.archived_at or timezone.now()
+    with transaction.atomic():
+        menu_week.meal_summaries.all().delete()
+        menu_week.ingredient_summaries.all().delete()
+        MenuWeekMealSummary.objects.bulk_create([
+            MenuWeekMealSummary(
+                menu_week=menu_week,
+                meal_id=row['meal_id'],
+                meal_name=row['name'],
+                units=row['units'],
+                revenue=Money(row['revenue'], 'USD'),
+                unit_cost=Money(row['unit_cost'], 'USD'),
+                cost=Money(row['cost'], 'USD'),
+                profit=Money(row['profit'], 'USD'),
+            )
+            for row in meal_margins(menu_week, priced_at)
+        ])
+        MenuWeekIngredientSummary.objects.bulk_create([
+            MenuWeekIngredientSummary(
+                menu_week=menu_week,
+                ingredient_id=row['ingredient_id'],
+                ingredient_name=row['name'],
+                unit=row['unit'],
+                quantity=row['qty'],
+            )
+            for row in ingredient_requirements(menu_week, SOLD_STATUSES)
+        ])
+        menu_week.summarized_at = timezone.now()
+        menu_week.save(update_fields=['summarized_at'])
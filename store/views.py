@@ -1,85 +1,138 @@
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Sum
+from django.db import transaction
 from django.contrib import messages
+from django.http import Http404
 from django.utils import timezone
-from .models import MenuWeek, MenuItem, Order, OrderItem
+from .models import MenuWeek, MenuItem, Order, PendingCheckout
 from .forms import MenuItemForm, MenuWeekForm
+from .admission import admission_wait
+from .checkout import SoldOut, aqueue_checkout, place_order, requested_quantities
+from .exports import (
+    GROCERY_COLUMNS,
+    ORDER_BOOK_COLUMNS,
+    PREP_SHEET_COLUMNS,
+    grocery_list_rows,
+    order_book_rows,
+    prep_sheet_rows,
+    stream_rows,
+)
+from .requirements import ingredient_requirements, recipe_servings, stock_shortfalls
+from .snapshots import summarize_menu_week, summary_totals, week_summary
 from users.models import User
 
-def home(request):
+# Orders the kitchen cooks for: the grocery list and prep sheet both count these.
+FULFILLMENT_STATUSES = ('PAID',)
+
+async def _auser(request):
+    """
+    Loads the user through the async ORM and pins it on the request, so
+    templates (and the auth context processor) read it without a sync query.
+    """
+    request.user = await request.auser()
+    return request.user
+
+def waiting_room(request, retry_after):
+    """
+    503 page for requests turned away by admission control. Standalone, so
+    rendering it queries nothing; a turned-away checkout can be re-sent as is.
+    """
+    cart = [(name, value) for name, value in request.POST.items() if name != 'csrfmiddlewaretoken']
+    response = render(
+        request, 'store/waiting_room.html', {'retry_after': retry_after, 'cart': cart}, status=503,
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+async def home(request):
     """
     Landing Page: Shows the currently active MenuWeek.
     """
     # Fetch the currently active week (The Drop)
-    active_week = MenuWeek.objects.filter(is_active=True, is_archived=False).first()
+    active_week = await MenuWeek.objects.filter(is_active=True, is_archived=False).afirst()
+    if active_week:
+        wait = await admission_wait(active_week, 'home')
+        if wait:
+            return waiting_room(request, wait)
+    await _auser(request)
+    items = None
+    if active_week:
+        items = [item async for item in active_week.items.select_related('meal').filter(meal__isnull=False)]
     
     context = {
         'active_week': active_week,
         # If no week is active, items will be None, template handles "Closed" state
-        'items': active_week.items.select_related('meal').filter(meal__isnull=False) if active_week else None
+        'items': items,
+        # Sent back with the cart so a double-submitted checkout places one order.
+        'idempotency_key': uuid.uuid4().hex,
     }
     return render(request, 'store/home.html', context)
 
 @login_required
-def checkout(request):
+async def checkout(request):
     """
     Processes the order submission.
     Expects POST data in format: item_<menu_item_id> = quantity
     """
     if request.method == 'POST':
-        active_week = MenuWeek.objects.filter(is_active=True).first()
+        user = await _auser(request)
+        active_week = await MenuWeek.objects.filter(is_active=True).afirst()
         if not active_week:
             messages.error(request, "Ordering is currently closed.")
             return redirect('home')
+        wait = await admission_wait(active_week, 'checkout')
+        if wait:
+            return waiting_room(request, wait)
+
+        quantities = requested_quantities(request.POST)
+        idempotency_key = request.POST.get('idempotency_key') or None
+        if settings.CHECKOUT_QUEUED:
+            # Intake mode: record the cart and let process_checkouts place it.
+            if await aqueue_checkout(user, active_week, quantities, idempotency_key=idempotency_key):
+                messages.success(request, "Order received! It will show below once it has been placed.")
+                return redirect('profile')
+            messages.warning(request, "Your cart was empty.")
+            return redirect('home')
 
-        # 1. Create the Order shell
-        order = Order.objects.create(
-            customer=request.user,
-            menu_week=active_week,
-            status='PENDING' # Default status
-        )
-        
-        has_items = False
-        
-        # 2. Loop through POST data to find items
-        for key, value in request.POST.items():
-            if key.startswith('item_'):
-                try:
-                    item_id = int(key.split('_')[1])
-                    quantity = int(value)
-                    
-                    if quantity > 0:
-                        menu_item = get_object_or_404(MenuItem, id=item_id)
-                        # Verify item belongs to active week to prevent tampering
-                        if menu_item.menu_week == active_week:
-                            OrderItem.objects.create(
-                                order=order,
-                                menu_item=menu_item,
-                                quantity=quantity
-                            )
-                            has_items = True
-                except ValueError:
-                    continue
-
-        if has_items:
+        try:
+            # Placing an order is one transaction, which the async ORM can't
+            # span, so it runs on the sync thread.
+            order = await sync_to_async(place_order)(user, active_week, quantities, idempotency_key=idempotency_key)
+        except SoldOut as exc:
+            messages.error(request, f"Sorry, {exc.menu_item} just sold out. Your order was not placed.")
+            return redirect('home')
+
+        if order:
             messages.success(request, "Order placed successfully! Please pay below.")
             return redirect('profile') # Redirect to profile to see the order/pay
         else:
-            order.delete() # Cleanup empty order
             messages.warning(request, "Your cart was empty.")
             return redirect('home')
 
     return redirect('home')
 
 @login_required
-def profile(request):
+async def profile(request):
     """
     User Dashboard: Shows past and current orders.
     """
-    orders = Order.objects.filter(customer=request.user).order_by('-created_at')
-    return render(request, 'store/profile.html', {'orders': orders})
+    user = await _auser(request)
+    orders = [
+        order
+        async for order in Order.objects.filter(customer=user)
+        .order_by('-created_at')
+        .prefetch_related('items__menu_item__meal')
+    ]
+    # Carts queued by checkout intake mode that aren't orders yet, or failed.
+    pending_checkouts = [
+        pending async for pending in PendingCheckout.objects.filter(customer=user).order_by('-created_at')
+    ]
+    return render(request, 'store/profile.html', {'orders': orders, 'pending_checkouts': pending_checkouts})
 
 
 @staff_member_required
@@ -97,46 +150,71 @@ def batch_fulfillment_report(request):
     Chef's View: Aggregates ingredients for the ACTIVE week's PAID orders.
     """
     active_week = MenuWeek.objects.filter(is_active=True, is_archived=False).first()
-    grocery_list = {}
-
-    if active_week:
-        # Get all PAID orders for the active week
-        # We traverse: Order -> OrderItems -> MenuItem -> MenuWeek
-        paid_orders = Order.objects.filter(
-            status='PAID',
-            items__menu_item__menu_week=active_week
-        ).distinct()
-
-        for order in paid_orders:
-            for item in order.items.select_related('menu_item__meal'):
-                meal = item.menu_item.meal
-                if not meal:
-                    continue
-                # For each meal ordered, aggregate recipe ingredients
-                for mr in meal.meal_recipes.all():
-                    recipe_ingredients = mr.recipe.recipe_ingredients.all()
-                    for ri in recipe_ingredients:
-                        resolved = ri.resolved_ingredient
-                        ingredient_name = resolved.name if resolved else ri.ingredient_name
-                        ingredient_unit = resolved.unit_display if resolved else (ri.ingredient_unit.name if ri.ingredient_unit else '')
-                        if not ingredient_name:
-                            continue
-                        # Total needed = (Amount per recipe * meal recipe qty * order item qty)
-                        total_needed = ri.quantity * mr.quantity * item.quantity
-
-                        if ingredient_name in grocery_list:
-                            grocery_list[ingredient_name]['qty'] += total_needed
-                        else:
-                            grocery_list[ingredient_name] = {
-                                'qty': total_needed,
-                                'unit': ingredient_unit
-                            }
+    grocery_list = ingredient_requirements(active_week, statuses=FULFILLMENT_STATUSES) if active_week else []
 
     return render(request, 'store/report.html', {
         'grocery_list': grocery_list,
         'active_week': active_week
     })
     
+@staff_member_required
+def export_fulfillment_report(request, fmt):
+    """Streams the active week's PAID grocery list as CSV or NDJSON."""
+    active_week = MenuWeek.objects.filter(is_active=True, is_archived=False).first()
+    if not active_week:
+        raise Http404("No active menu week.")
+    return stream_rows(
+        request, GROCERY_COLUMNS, grocery_list_rows(active_week, FULFILLMENT_STATUSES),
+        fmt, f'grocery-list-week-{active_week.pk}',
+    )
+
+@staff_member_required
+def prep_sheet(request):
+    """
+    Chef's View: servings of each recipe to make for the ACTIVE week's PAID
+    orders, across every meal that includes it.
+    """
+    active_week = MenuWeek.objects.filter(is_active=True, is_archived=False).first()
+    recipes = recipe_servings(active_week, statuses=FULFILLMENT_STATUSES) if active_week else []
+
+    return render(request, 'store/prep_sheet.html', {
+        'recipes': recipes,
+        'active_week': active_week,
+    })
+
+@staff_member_required
+def export_prep_sheet(request, fmt):
+    """Streams the active week's PAID prep sheet as CSV or NDJSON."""
+    active_week = MenuWeek.objects.filter(is_active=True, is_archived=False).first()
+    if not active_week:
+        raise Http404("No active menu week.")
+    return stream_rows(
+        request, PREP_SHEET_COLUMNS, prep_sheet_rows(active_week, FULFILLMENT_STATUSES),
+        fmt, f'prep-sheet-week-{active_week.pk}',
+    )
+
+@staff_member_required
+def shopping_list(request):
+    """
+    Chef's View: what the pantry is short of for every open (PENDING or
+    PAID) order in the ACTIVE week, with an estimated cost to restock.
+    """
+    active_week = MenuWeek.objects.filter(is_active=True, is_archived=False).first()
+    shortfalls = stock_shortfalls(active_week) if active_week else []
+    priced = [row['cost'] for row in shortfalls if row['cost'] is not None]
+
+    return render(request, 'store/shopping_list.html', {
+        'shortfalls': shortfalls,
+        'estimated_total': sum(priced) if priced else None,
+        'active_week': active_week,
+    })
+
+@staff_member_required
+def export_order_book(request, week_id, fmt):
+    """Streams every OrderItem in a MenuWeek as CSV or NDJSON."""
+    week = get_object_or_404(MenuWeek, id=week_id)
+    return stream_rows(request, ORDER_BOOK_COLUMNS, order_book_rows(week), fmt, f'order-book-week-{week.pk}')
+
 @staff_member_required
 def add_menu_item(request):
     if request.method == 'POST':
@@ -179,12 +257,41 @@ def delete_menu_item(request, item_id):
     menu_item.delete()
     return redirect('chef_dashboard')
 
+@staff_member_required
+def refresh_menu_week_prices(request, week_id):
+    """Re-captures the week's meal prices and costs and re-costs its PENDING orders."""
+    week = get_object_or_404(MenuWeek, id=week_id, is_archived=False)
+    if request.method == 'POST':
+        with transaction.atomic():
+            week.snapshot_prices(reprice_open_orders=True)
+    return redirect('chef_dashboard')
+
 @staff_member_required
 def archive_menu_week(request, week_id):
     week = get_object_or_404(MenuWeek, id=week_id)
     if request.method == 'POST':
-        week.is_active = False
-        week.is_archived = True
-        week.archived_at = timezone.now()
-        week.save(update_fields=['is_active', 'is_archived', 'archived_at'])
-    return redirect('chef_dashboard')
\ No newline at end of file
+        with transaction.atomic():
+            week.is_active = False
+            week.is_archived = True
+            week.archived_at = timezone.now()
+            week.save(update_fields=['is_active', 'is_archived', 'archived_at'])
+            summarize_menu_week(week)
+    return redirect('chef_dashboard')
+
+@staff_member_required
+def menu_week_report(request, week_id):
+    """
+    Margin report and grocery list for one MenuWeek. Archived weeks read
+    the summary frozen when they were archived; open weeks are computed
+    live, with meal costs priced as of now.
+    """
+    week = get_object_or_404(MenuWeek, id=week_id)
+    rows, grocery_list = week_summary(week)
+
+    return render(request, 'store/week_report.html', {
+        'week': week,
+        'priced_at': week.archived_at or timezone.now(),
+        'rows': rows,
+        'totals': summary_totals(rows),
+        'grocery_list': grocery_list,
+    })